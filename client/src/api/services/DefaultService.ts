@@ -116,6 +116,24 @@ export class DefaultService {
       },
     });
   }
+  /**
+   * Arm Stop
+   * @param servo
+   * @returns any Successful Response
+   * @throws ApiError
+   */
+  public armStopArmStopPost(servo?: string | null): CancelablePromise<any> {
+    return this.httpRequest.request({
+      method: "POST",
+      url: "/arm/stop",
+      query: {
+        servo: servo,
+      },
+      errors: {
+        422: `Validation Error`,
+      },
+    });
+  }
   /**
    * Arm Home
    * @returns any Successful Response
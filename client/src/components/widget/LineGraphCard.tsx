@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useEffect, useState } from "react";
 import { Line } from "react-chartjs-2";
 import "react-circular-progressbar/dist/styles.css";
 
@@ -12,9 +12,8 @@ import {
   Legend,
 } from "chart.js";
 import colors from "tailwindcss/colors";
-import { useInterval } from "usehooks-ts";
-
-import { CancelablePromise } from "../../api";
+import { AppClient } from "../../api";
+import { getSensorSocket } from "../../hooks/sensorSocket";
 import { useTheme } from "../../hooks/useTheme";
 
 interface Dictionary<T> {
@@ -24,7 +23,8 @@ interface Dictionary<T> {
 export const LineGraphCard = ({
   title,
   updatePeriod,
-  promiseGenerator,
+  client,
+  sensorName,
   length,
   series,
 }: {
@@ -32,31 +32,32 @@ export const LineGraphCard = ({
   updatePeriod: number;
   length: number;
   series: string[];
-  promiseGenerator: () => CancelablePromise<any>;
+  client: AppClient;
+  sensorName: string;
 }) => {
   const [data, setData] = useState<Dictionary<Array<number>>>();
-  const [loading, setLoading] = useState(false);
   const { isDark } = useTheme(); // Fix: destructure isDark from the hook
 
-  useInterval(
-    () => {
-      setLoading(true);
-      promiseGenerator()
-        .then((response) => response)
-        .then((newValue: { [key: string]: number }) => {
-          setLoading(false);
+  useEffect(() => {
+    // Readings are pushed over the shared sensor socket rather than polled
+    const socket = getSensorSocket(client.request.config.BASE);
+    return socket.subscribe(
+      sensorName,
+      1000 / updatePeriod,
+      (newValue: { [key: string]: number }) => {
+        setData((data) => {
           const newState: Dictionary<Array<number>> = {};
-          series.forEach((s, i) => {
+          series.forEach((s) => {
             newState[s] = data ? [...data[s], newValue[s]] : [newValue[s]];
             if (newState[s].length > length) {
               newState[s].shift();
             }
           });
-          setData(newState);
+          return newState;
         });
-    },
-    loading ? null : updatePeriod,
-  );
+      },
+    );
+  }, [client, sensorName, updatePeriod]);
 
   ChartJS.register(
     CategoryScale,
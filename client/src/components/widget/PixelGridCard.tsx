@@ -1,9 +1,8 @@
 import { useEffect, useRef, useState } from "react";
 import "react-circular-progressbar/dist/styles.css";
 
-import { useInterval } from "usehooks-ts";
-
-import { CancelablePromise } from "../../api";
+import { AppClient } from "../../api";
+import { getSensorSocket } from "../../hooks/sensorSocket";
 
 function hsl2rgba(h: number, s: number, l: number) {
   let a = s * Math.min(l, 1 - l);
@@ -19,7 +18,8 @@ export const PixelGridCard = ({
   updatePeriod,
   tempRange,
   hslRange,
-  promiseGenerator,
+  client,
+  sensorName,
 }: {
   title: string;
   width: number;
@@ -27,10 +27,10 @@ export const PixelGridCard = ({
   updatePeriod: number;
   tempRange: [number, number];
   hslRange: [number, number];
-  promiseGenerator: () => CancelablePromise<any>;
+  client: AppClient;
+  sensorName: string;
 }) => {
   const [value, setValue] = useState<Array<number>>();
-  const [loading, setLoading] = useState(false);
   const canvasRef = useRef<HTMLCanvasElement>(null);
   const [size, setSize] = useState({ width, height });
 
@@ -39,24 +39,16 @@ export const PixelGridCard = ({
     return 360 - ((tempRange[1] - nowTemp) * sDeg - (hslRange[1] - 360));
   };
 
-  useInterval(
-    () => {
-      // Your custom logic here
-      setLoading(true);
-      promiseGenerator()
-        .then((response) => response)
-        .then((val) => {
-          //console.log(val + " " + getHue(val[0]))
-          if (val.length == 768) {
-            setSize({ height: 24, width: 32 });
-          }
-          setLoading(false);
-          setValue(val.map((s: number) => hsl2rgba(getHue(s), 1, 0.5)).flat());
-        });
-    },
-    // Delay in milliseconds or null to stop it
-    loading ? null : updatePeriod,
-  );
+  useEffect(() => {
+    // Frames are pushed over the shared sensor socket rather than polled
+    const socket = getSensorSocket(client.request.config.BASE);
+    return socket.subscribe(sensorName, 1000 / updatePeriod, (val) => {
+      if (val.length == 768) {
+        setSize({ height: 24, width: 32 });
+      }
+      setValue(val.map((s: number) => hsl2rgba(getHue(s), 1, 0.5)).flat());
+    });
+  }, [client, sensorName, updatePeriod]);
 
   useEffect(() => {
     if (canvasRef.current && value) {
@@ -88,9 +88,8 @@ export const SelectableCard = ({
                 tempRange={[0, 30]}
                 hslRange={[0, 90]}
                 updatePeriod={500}
-                promiseGenerator={() =>
-                  client.default.sensorSensorSensorIdGet(sensorName)
-                }
+                client={client}
+                sensorName={sensorName}
               />
             ),
           });
@@ -105,9 +104,8 @@ export const SelectableCard = ({
                 updatePeriod={500}
                 length={20}
                 series={["eCO2", "TVOC"]}
-                promiseGenerator={() =>
-                  client.default.sensorSensorSensorIdGet(sensorName)
-                }
+                client={client}
+                sensorName={sensorName}
               />
             ),
           });
@@ -0,0 +1,81 @@
+// Persistent teleoperation socket, so joystick and keyboard commands don't each
+// pay for an HTTP request. Commands are sequenced so the server can drop any
+// that arrive after a newer one.
+export type ControlCommand =
+  | { type: "drive"; speed: number[] }
+  | { type: "stop" }
+  | { type: "servo"; servo: string; direction: boolean; amount?: number }
+  | { type: "arm_stop"; servo?: string }
+  | { type: "home" }
+  | { type: "preset"; preset: string };
+
+const RECONNECT_DELAY = 2000;
+
+class ControlSocket {
+  private base: string;
+  private socket: WebSocket | null = null;
+  private reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+  private seq = 0;
+  // When each unacknowledged command was sent, for round trip times
+  private sentAt = new Map<number, number>();
+  // Round trip time of the last acknowledged command, in ms
+  latency: number | null = null;
+
+  constructor(base: string) {
+    this.base = base;
+    this.connect();
+  }
+
+  // Returns false if the socket isn't open, so the caller can fall back to HTTP
+  send(command: ControlCommand) {
+    if (!this.socket || this.socket.readyState !== WebSocket.OPEN) {
+      this.connect();
+      return false;
+    }
+    this.seq += 1;
+    this.sentAt.set(this.seq, performance.now());
+    this.socket.send(JSON.stringify({ seq: this.seq, ...command }));
+    return true;
+  }
+
+  private url() {
+    const url = new URL(`${this.base}/control`, window.location.href);
+    url.protocol = url.protocol === "https:" ? "wss:" : "ws:";
+    return url.toString();
+  }
+
+  private connect() {
+    if (this.socket || this.reconnectTimer) return;
+    const socket = new WebSocket(this.url());
+    this.socket = socket;
+    socket.onmessage = (event) => {
+      const reply = JSON.parse(event.data);
+      const sent = this.sentAt.get(reply.ack);
+      if (sent !== undefined) {
+        this.latency = performance.now() - sent;
+        this.sentAt.delete(reply.ack);
+      }
+      if (reply.error) {
+        console.warn(`Control command ${reply.ack} failed: ${reply.error}`);
+      }
+    };
+    socket.onclose = () => {
+      if (this.socket !== socket) return;
+      this.socket = null;
+      this.sentAt.clear();
+      this.reconnectTimer = setTimeout(() => {
+        this.reconnectTimer = null;
+        this.connect();
+      }, RECONNECT_DELAY);
+    };
+  }
+}
+
+const sockets = new Map<string, ControlSocket>();
+
+export const getControlSocket = (base: string) => {
+  if (!sockets.has(base)) {
+    sockets.set(base, new ControlSocket(base));
+  }
+  return sockets.get(base)!;
+};
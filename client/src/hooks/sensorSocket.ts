@@ -0,0 +1,110 @@
+// Single WebSocket shared by every component that wants live sensor data.
+// The server pushes batched samples for all subscribed sensors, so there is no
+// per-sensor polling.
+type Listener = (value: any) => void;
+
+interface Subscriber {
+  listener: Listener;
+  // Most updates per second this subscriber wants
+  rate: number;
+}
+
+const RECONNECT_DELAY = 2000;
+
+class SensorSocket {
+  private base: string;
+  private socket: WebSocket | null = null;
+  private subscribers = new Map<string, Set<Subscriber>>();
+  private reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+
+  constructor(base: string) {
+    this.base = base;
+  }
+
+  subscribe(sensor: string, rate: number, listener: Listener) {
+    const subscriber = { listener, rate };
+    if (!this.subscribers.has(sensor)) {
+      this.subscribers.set(sensor, new Set());
+    }
+    this.subscribers.get(sensor)!.add(subscriber);
+    this.connect();
+    this.sendSubscriptions();
+
+    return () => {
+      const set = this.subscribers.get(sensor);
+      set?.delete(subscriber);
+      if (set && set.size === 0) {
+        this.subscribers.delete(sensor);
+      }
+      if (this.subscribers.size === 0) {
+        this.close();
+      } else {
+        this.sendSubscriptions();
+      }
+    };
+  }
+
+  private url() {
+    const url = new URL(`${this.base}/sensor/subscribe`, window.location.href);
+    url.protocol = url.protocol === "https:" ? "wss:" : "ws:";
+    return url.toString();
+  }
+
+  private connect() {
+    if (this.socket || this.reconnectTimer) return;
+    const socket = new WebSocket(this.url());
+    this.socket = socket;
+    socket.onopen = () => this.sendSubscriptions();
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.error) {
+        console.warn(`Sensor subscription failed: ${message.error}`);
+        return;
+      }
+      Object.entries(message.data).forEach(([sensor, sample]: [string, any]) => {
+        this.subscribers
+          .get(sensor)
+          ?.forEach((subscriber) => subscriber.listener(sample.value));
+      });
+    };
+    socket.onclose = () => {
+      if (this.socket !== socket) return;
+      this.socket = null;
+      // Reconnect (e.g. after the server reloaded its settings) while anyone is listening
+      if (this.subscribers.size > 0) {
+        this.reconnectTimer = setTimeout(() => {
+          this.reconnectTimer = null;
+          this.connect();
+        }, RECONNECT_DELAY);
+      }
+    };
+  }
+
+  private sendSubscriptions() {
+    if (!this.socket || this.socket.readyState !== WebSocket.OPEN) return;
+    const sensors: Record<string, number> = {};
+    this.subscribers.forEach((set, sensor) => {
+      sensors[sensor] = Math.max(...Array.from(set, (s) => s.rate));
+    });
+    this.socket.send(JSON.stringify({ sensors }));
+  }
+
+  private close() {
+    if (this.reconnectTimer) {
+      clearTimeout(this.reconnectTimer);
+      this.reconnectTimer = null;
+    }
+    const socket = this.socket;
+    this.socket = null;
+    socket?.close();
+  }
+}
+
+const sockets = new Map<string, SensorSocket>();
+
+export const getSensorSocket = (base: string) => {
+  if (!sockets.has(base)) {
+    sockets.set(base, new SensorSocket(base));
+  }
+  return sockets.get(base)!;
+};
@@ -1,6 +1,7 @@
 import { useState, useEffect } from "react";
 
 import { AppClient } from "../api";
+import { getSensorSocket } from "./sensorSocket";
 
 export const useSystemInfo = (
   client: AppClient,
@@ -11,20 +12,12 @@ export const useSystemInfo = (
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    const fetchData = async () => {
-      try {
-        const result = await client.default.sensorSensorSensorIdGet(sensorName);
-        setData(result);
-        setLoading(false);
-      } catch (error) {
-        console.error("System info fetch failed:", error);
-        setLoading(false);
-      }
-    };
-
-    fetchData();
-    const interval = setInterval(fetchData, updatePeriod);
-    return () => clearInterval(interval);
+    // Samples are pushed over the shared sensor socket rather than polled
+    const socket = getSensorSocket(client.request.config.BASE);
+    return socket.subscribe(sensorName, 1000 / updatePeriod, (value) => {
+      setData(value);
+      setLoading(false);
+    });
   }, [client, sensorName, updatePeriod]);
 
   return { data, loading };
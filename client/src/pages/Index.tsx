@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useRef, useState } from "react";
 import { useHotkeys } from "react-hotkeys-hook";
 import { Keys } from "react-hotkeys-hook/dist/types";
 
@@ -8,6 +8,10 @@ import { AppClient, OpenAPI } from "../api";
 import { Loader } from "../components/ui/Loader";
 import { SelectableCard } from "../components/widget/SelectableCard";
 import useApi from "../useApi";
+import { getControlSocket } from "../hooks/controlSocket";
+
+// How often a held arm key repeats its jog, well inside the server's jog_timeout
+const JOG_REPEAT = 50;
 
 function Index() {
   const client = new AppClient(OpenAPI);
@@ -15,11 +19,23 @@ function Index() {
   const sensors = useApi(client.default.sensorListSensorListGet());
   const [speed, setSpeed] = useState<number>(3);
 
+  // Commands go over the control socket, falling back to HTTP while it's connecting
+  const control = getControlSocket(client.request.config.BASE);
+  const drive = (speeds: number[]) =>
+    control.send({ type: "drive", speed: speeds }) ||
+    client.default.driveDrivePost({ speed: speeds });
+  const stop = () =>
+    control.send({ type: "stop" }) || client.default.driveStopDriveStopPost();
+  const moveServo = (servo: string, direction: boolean) =>
+    control.send({ type: "servo", servo, direction }) ||
+    client.default.armMoveArmServoServoNamePost(servo, { direction });
+  const armStop = (servo: string) =>
+    control.send({ type: "arm_stop", servo }) ||
+    client.default.armStopArmStopPost(servo);
+
   const useDriveHotkey = (key: Keys, left: number, right: number) => {
-    useHotkeys(key, () =>
-      client.default.driveDrivePost({ speed: [speed * left, speed * right] }),
-    );
-    useHotkeys(key, () => client.default.driveStopDriveStopPost(), {
+    useHotkeys(key, () => drive([speed * left, speed * right]));
+    useHotkeys(key, stop, {
       keydown: false,
       keyup: true,
     });
@@ -31,47 +47,53 @@ function Index() {
   useHotkeys("equal", () => setSpeed((prev) => Math.min(8, prev + 1)));
   useHotkeys("minus", () => setSpeed((prev) => Math.max(1, prev - 1)));
 
-  useHotkeys("num1", () =>
-    client.default.armMoveArmServoServoNamePost("SHOULDER", {
-      direction: true,
-    }),
-  );
-  useHotkeys("num4", () =>
-    client.default.armMoveArmServoServoNamePost("SHOULDER", {
-      direction: false,
-    }),
-  );
-  useHotkeys("num2", () =>
-    client.default.armMoveArmServoServoNamePost("ELBOW", { direction: false }),
-  );
-  useHotkeys("num5", () =>
-    client.default.armMoveArmServoServoNamePost("ELBOW", { direction: true }),
-  );
-  useHotkeys("num3", () =>
-    client.default.armMoveArmServoServoNamePost("WRISTUD", {
-      direction: false,
-    }),
-  );
-  useHotkeys("num6", () =>
-    client.default.armMoveArmServoServoNamePost("WRISTUD", { direction: true }),
-  );
-  useHotkeys("num7", () =>
-    client.default.armMoveArmServoServoNamePost("WRISTLR", { direction: true }),
-  );
-  useHotkeys("num8", () =>
-    client.default.armMoveArmServoServoNamePost("WRISTLR", {
-      direction: false,
-    }),
-  );
+  // Joints move while the key is held, like driving. The jog is repeated on a timer rather than
+  // by key repeat, which pauses for longer than the server waits before stopping the joint.
+  const jogs = useRef(new Map<string, ReturnType<typeof setInterval>>());
+  const useServoHotkey = (key: Keys, servo: string, direction: boolean) => {
+    const jog = `${servo}:${direction}`;
+    useHotkeys(key, () => {
+      if (jogs.current.has(jog)) return;
+      moveServo(servo, direction);
+      jogs.current.set(
+        jog,
+        setInterval(() => moveServo(servo, direction), JOG_REPEAT),
+      );
+    });
+    useHotkeys(
+      key,
+      () => {
+        clearInterval(jogs.current.get(jog));
+        jogs.current.delete(jog);
+        armStop(servo);
+      },
+      {
+        keydown: false,
+        keyup: true,
+      },
+    );
+  };
+  useServoHotkey("num1", "SHOULDER", true);
+  useServoHotkey("num4", "SHOULDER", false);
+  useServoHotkey("num2", "ELBOW", false);
+  useServoHotkey("num5", "ELBOW", true);
+  useServoHotkey("num3", "WRISTUD", false);
+  useServoHotkey("num6", "WRISTUD", true);
+  useServoHotkey("num7", "WRISTLR", true);
+  useServoHotkey("num8", "WRISTLR", false);
 
-  useHotkeys(Key.Add, () =>
-    client.default.armMoveArmServoServoNamePost("CLAW", { direction: true }),
+  useServoHotkey(Key.Add, "CLAW", true);
+  useServoHotkey(Key.Subtract, "CLAW", false);
+  useHotkeys(
+    "num0",
+    () => control.send({ type: "home" }) || client.default.armHomeArmHomePost(),
   );
-  useHotkeys(Key.Subtract, () =>
-    client.default.armMoveArmServoServoNamePost("CLAW", { direction: false }),
+  useHotkeys(
+    "num.",
+    () =>
+      control.send({ type: "preset", preset: "drive" }) ||
+      client.default.armHomeArmPresetPresetPost("drive"),
   );
-  useHotkeys("num0", () => client.default.armHomeArmHomePost());
-  useHotkeys("num.", () => client.default.armHomeArmPresetPresetPost("drive"));
 
   if (cameras.loading || sensors.loading || !cameras.data || !sensors.data)
     return <Loader />;
@@ -8,8 +8,11 @@ Numeric Keypad Controls:
             +/- > CLAW OPEN/CLOSE
             0 > Home Device
 '''
-import asyncio
 import logging
+import struct
+import threading
+import time
+from dataclasses import dataclass
 from typing import Optional
 from pydantic import BaseModel
 
@@ -32,8 +35,29 @@ class ArmConfig(BaseModel):
     # HiWonder settings (only needed if mode is "hiwonder")
     hiwonder: Optional[dict] = None
     firmata: Optional[dict] = None
+    # Servo updates per second while moving
+    control_rate: float = 20.0
+    # Degrees per second of the joint that has furthest to go when moving to a pose,
+    # the others are slowed down so every joint arrives at the same time
+    max_speed: float = 90.0
+    # Degrees per second when jogging a joint, after an immediate first step so a short tap still
+    # moves it. Jogs end when the client stops them, or jog_timeout after the last repeat in case
+    # the stop never arrives, so a lost stop overshoots by at most jog_step + jog_speed * jog_timeout.
+    jog_speed: float = 20.0
+    jog_step: float = 1.8
+    jog_timeout: float = 0.15
+
+@dataclass
+class Trajectory:
+    start: dict[int, float]
+    target: dict[int, float]
+    started: float
+    duration: float
 
 class Arm:
+    # Milliseconds HiWonder servos are given to reach home on startup, from wherever they were
+    HOME_TIME = 1000
+
     def __init__(self, config: ArmConfig):
         self.logger = logging.getLogger(__name__)
         self.config = config
@@ -54,8 +78,42 @@ class Arm:
         # Set up current angles tracking
         self.CURRENT_ANGLES = {servo.index: servo.home for servo in self.config.servos.values()}
 
+        # Commands only change what the control loop is aiming for, and the newest one wins:
+        # a pose replaces the active trajectory and any jogs, a jog cancels the trajectory
+        self.lock = threading.Lock()
+        self.trajectory: Optional[Trajectory] = None
+        # Servo index to (degrees per second, when the jog ends)
+        self.velocities: dict[int, tuple[float, float]] = {}
+        # Servo index to degrees to add on the next update, for the first step of a jog
+        self.steps: dict[int, float] = {}
+
         # Home the arm
-        asyncio.create_task(self.home())
+        self._home_on_start()
+
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="arm-control", daemon=True)
+        self.thread.start()
+
+    def _home_on_start(self):
+        """Bring the arm home from wherever it was left, without snapping to it"""
+        home = {servo.index: servo.home for servo in self.config.servos.values()}
+        if self.mode == "hiwonder":
+            # Positions can't be read back, so the controller is given time for the first move
+            indexes = list(home)
+            self.controller.cmd_servo_move(indexes, [self._angle_to_hiwonder(home[index]) for index in indexes], self.HOME_TIME)
+            return
+        # The PCA9685 keeps driving its outputs across restarts, so servos that are still powered
+        # start from their current angle and are moved home by the control loop like any other pose
+        unpowered = {}
+        for index in home:
+            angle = self.kit.servo[index].angle
+            if angle is None:
+                unpowered[index] = home[index]
+            else:
+                self.CURRENT_ANGLES[index] = max(0, min(180, angle))
+        if unpowered:
+            self._write(unpowered)
+        self.move_pose({name: servo.home for name, servo in self.config.servos.items()})
 
     def _setup_servokit(self):
         """Initialize ServoKit for original implementation"""
@@ -120,45 +178,163 @@ class Arm:
             return
 
         self.logger.info("Moving to home position")
-
-        for name, servo in self.config.servos.items():
-            if self.mode == "servokit":
-                self.kit.servo[servo.index].angle = servo.home
-                self.CURRENT_ANGLES[servo.index] = servo.home
-
-            elif self.mode == "hiwonder":
-                hiwonder_pos = self._angle_to_hiwonder(servo.home)
-                self.controller.cmd_servo_move([servo.index], [hiwonder_pos], 1000)
-                self.CURRENT_ANGLES[servo.index] = servo.home
-
-            # Delays for specific joints
-            if name == "WRISTLR" or name == "WRISTUD":
-                await asyncio.sleep(0.25)
+        self.move_pose({name: servo.home for name, servo in self.config.servos.items()})
 
     async def move_preset(self, preset_name: str):
         if not self.enabled:
             return
 
         self.logger.info(f"Moving to preset: {preset_name}")
+        self.move_pose({
+            name: servo.presets[preset_name]
+            for name, servo in self.config.servos.items()
+            if servo.presets and preset_name in servo.presets
+        })
+
+    def move_pose(self, angles: dict[str, float]):
+        """
+        Move several joints together along a straight line in joint space, so they all arrive at
+        the same time. Replaces whatever the arm was doing.
+        """
+        if not self.enabled:
+            return
 
-        for name, servo in self.config.servos.items():
-            if not servo.presets or preset_name not in servo.presets:
+        target = {}
+        for joint, angle in angles.items():
+            if joint not in self.config.servos:
+                self.logger.error(f"Joint {joint} not found in configuration")
                 continue
+            target[self.config.servos[joint].index] = max(0, min(180, angle))
+
+        with self.lock:
+            self.velocities.clear()
+            self.steps.clear()
+            if not target:
+                self.trajectory = None
+                return
+            start = {index: self.CURRENT_ANGLES[index] for index in target}
+            distance = max(abs(target[index] - start[index]) for index in target)
+            self.trajectory = Trajectory(start, target, time.monotonic(), distance / self.config.max_speed)
+
+    def jog(self, joint: str, direction: bool, speed: Optional[float] = None):
+        """Move a joint at a steady speed until halted, or jog_timeout after the last call for it"""
+        if not self.enabled:
+            return
 
-            target_angle = servo.presets[preset_name]
+        if joint not in self.config.servos:
+            self.logger.error(f"Joint {joint} not found in configuration")
+            return
 
-            if self.mode == "servokit":
-                self.kit.servo[servo.index].angle = target_angle
-                self.CURRENT_ANGLES[servo.index] = target_angle
+        speed = self.config.jog_speed if speed is None else abs(speed)
+        index = self.config.servos[joint].index
+        with self.lock:
+            self.trajectory = None
+            if index not in self.velocities:
+                self.steps[index] = self.config.jog_step if direction else -self.config.jog_step
+            self.velocities[index] = (
+                speed if direction else -speed,
+                time.monotonic() + self.config.jog_timeout,
+            )
 
-            elif self.mode == "hiwonder":
-                hiwonder_pos = self._angle_to_hiwonder(target_angle)
-                self.controller.cmd_servo_move([servo.index], [hiwonder_pos], 1000)
-                self.CURRENT_ANGLES[servo.index] = target_angle
+    def halt(self, joint: Optional[str] = None):
+        """Stop where the arm is now, or only end the jog of one joint"""
+        if not self.enabled:
+            return
 
-            # Delay for elbow
-            if name == "ELBOW":
-                await asyncio.sleep(0.25)
+        if joint is not None:
+            if joint not in self.config.servos:
+                self.logger.error(f"Joint {joint} not found in configuration")
+                return
+            with self.lock:
+                self.velocities.pop(self.config.servos[joint].index, None)
+                self.steps.pop(self.config.servos[joint].index, None)
+            return
+
+        with self.lock:
+            self.trajectory = None
+            self.velocities.clear()
+            self.steps.clear()
+
+    def _run(self):
+        period = 1 / self.config.control_rate
+        deadline = time.monotonic()
+        while not self.stopping.wait(max(0.0, deadline - time.monotonic())):
+            deadline += period
+            # Don't try to catch up after a slow write
+            if deadline < time.monotonic():
+                deadline = time.monotonic()
+            with self.lock:
+                setpoints = self._step(time.monotonic(), period)
+            if not setpoints:
+                continue
+            try:
+                self._write(setpoints)
+            except Exception as e:
+                self.logger.error(f"Moving arm failed: {e}")
+
+    def _step(self, now: float, period: float) -> dict[int, float]:
+        """Next setpoint of every joint that is moving, called with the lock held"""
+        setpoints = {}
+        if self.trajectory is not None:
+            trajectory = self.trajectory
+            progress = 1.0 if trajectory.duration <= 0 else min(1.0, (now - trajectory.started) / trajectory.duration)
+            for index, target in trajectory.target.items():
+                start = trajectory.start[index]
+                setpoints[index] = start + (target - start) * progress
+            if progress >= 1.0:
+                self.trajectory = None
+        for index, (velocity, until) in list(self.velocities.items()):
+            if now >= until:
+                del self.velocities[index]
+                continue
+            step = self.steps.pop(index, 0.0)
+            setpoints[index] = max(0, min(180, self.CURRENT_ANGLES[index] + step + velocity * period))
+        changed = {index: angle for index, angle in setpoints.items() if abs(angle - self.CURRENT_ANGLES[index]) > 1e-3}
+        self.CURRENT_ANGLES.update(changed)
+        return changed
+
+    def _write(self, targets: dict[int, float]):
+        if self.mode == "servokit":
+            self._write_servokit(targets)
+        elif self.mode == "hiwonder":
+            indexes = list(targets)
+            positions = [self._angle_to_hiwonder(targets[index]) for index in indexes]
+            # Let the controller interpolate until the next setpoint
+            self.controller.cmd_servo_move(indexes, positions, round(1000 / self.config.control_rate))
+
+    def _write_servokit(self, targets: dict[int, float]):
+        """Write PCA9685 channels in blocks, relying on the register auto-increment ServoKit enables"""
+        try:
+            pca = self.kit._pca
+            registers = {}
+            for index, angle in targets.items():
+                servo = self.kit.servo[index]
+                # Same conversion as adafruit_motor's Servo.angle, without writing each channel separately
+                duty = servo._min_duty + int(angle / servo.actuation_range * servo._duty_range)
+                if duty == 0xFFFF:
+                    on, off = 0x1000, 0
+                elif duty < 0x0010:
+                    on, off = 0, 0x1000
+                else:
+                    on, off = 0, (duty + 1) >> 4
+                registers[index] = struct.pack("<HH", on, off)
+        except AttributeError:
+            # Library internals changed, set them one at a time
+            for index, angle in targets.items():
+                self.kit.servo[index].angle = angle
+            return
+
+        indexes = sorted(registers)
+        runs = [[indexes[0]]]
+        for index in indexes[1:]:
+            if index == runs[-1][-1] + 1:
+                runs[-1].append(index)
+            else:
+                runs.append([index])
+        with pca.i2c_device as i2c:
+            for run in runs:
+                # LEDn_ON_L of the first channel in the run, four registers per channel
+                i2c.write(bytes([0x06 + 4 * run[0]]) + b"".join(registers[index] for index in run))
 
     def increment_angle(self, joint: str, direction: bool, amount: float = 180/100):
         if not self.enabled:
@@ -173,28 +349,15 @@ class Arm:
             amount = 1.8
             self.logger.warning(f"Amount was None, using default: {amount}")
 
-        servo = self.config.servos[joint]
-        index = servo.index
-
-        # Calculate new angle
-        current_angle = self.CURRENT_ANGLES[index]
-        new_angle = current_angle + (amount * (1 if direction else -1))
-        new_angle = max(0, min(180, new_angle))  # Clamp to valid range
-
-        # Update servo based on mode
-        if self.mode == "servokit":
-            self.kit.servo[index].angle = new_angle
-            self.CURRENT_ANGLES[index] = new_angle
-            self.logger.info(f"ServoKit - joint: {joint} - angle: {new_angle}")
-
-        elif self.mode == "hiwonder":
-            hiwonder_pos = self._angle_to_hiwonder(new_angle)
-            self.controller.cmd_servo_move([index], [hiwonder_pos], 1000)
-            self.CURRENT_ANGLES[index] = new_angle
-            self.logger.info(f"HiWonder - joint: {joint} - angle: {new_angle} ({hiwonder_pos})")
+        # Step from where the joint is, through the control loop like any other move
+        current_angle = self.CURRENT_ANGLES[self.config.servos[joint].index]
+        self.move_pose({joint: current_angle + (amount * (1 if direction else -1))})
 
     def close(self):
         """Close connections"""
+        if self.enabled:
+            self.stopping.set()
+            self.thread.join(timeout=1)
         if self.mode == "hiwonder" and hasattr(self, 'firmata'):
             try:
                 self.firmata.exit()
@@ -0,0 +1,161 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from components.sensor import SensorConfig
+
+class I2CSensorConfig(SensorConfig):
+    # I2C bus number, e.g. 1 for /dev/i2c-1
+    bus: int = 1
+    # When several devices are waiting for the bus, lower numbers go first, then the earliest deadline
+    priority: int = 0
+
+@dataclass
+class DeviceStats:
+    transactions: int = 0
+    errors: int = 0
+    # Seconds spent holding the bus, and waiting for it
+    bus_time: float = 0.0
+    wait_time: float = 0.0
+    last_error: Optional[str] = None
+
+class I2CBus:
+    '''
+    One I2C bus, shared by every device on it. Transactions are serialized, and when the bus is
+    busy waiting transactions are started in order of priority and then deadline.
+    '''
+    def __init__(self, number: int):
+        self.logger = logging.getLogger(__name__)
+        self.number = number
+        self._smbus = None
+        self.condition = threading.Condition()
+        # Heap of (priority, deadline, order, thread) waiting for the bus
+        self.waiting: list[tuple[int, float, int, int]] = []
+        self.order = itertools.count()
+        self.owner: Optional[int] = None
+        self.depth = 0
+        self.devices: dict[str, DeviceStats] = {}
+
+    @property
+    def smbus(self):
+        # Only import SMBus when a device is actually used, to prevent import errors on non-i2c-enabled systems
+        with self.condition:
+            if self._smbus is None:
+                from smbus2 import SMBus
+                self._smbus = SMBus(self.number)
+            return self._smbus
+
+    def _acquire(self, priority: int, deadline: float) -> bool:
+        '''Returns whether this is the outermost transaction of the thread holding the bus'''
+        me = threading.get_ident()
+        with self.condition:
+            if self.owner == me:
+                self.depth += 1
+                return False
+            entry = (priority, deadline, next(self.order), me)
+            heapq.heappush(self.waiting, entry)
+            while self.owner is not None or self.waiting[0] != entry:
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.owner = me
+            self.depth = 1
+            return True
+
+    def _release(self):
+        with self.condition:
+            self.depth -= 1
+            if self.depth == 0:
+                self.owner = None
+                self.condition.notify_all()
+
+    @contextmanager
+    def transaction(self, device: str, priority: int = 0, deadline: Optional[float] = None):
+        '''Holds the bus for the duration of the block, nested transactions share the outer one'''
+        requested = time.monotonic()
+        outer = self._acquire(priority, requested if deadline is None else deadline)
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            held = time.monotonic() - started
+            self._release()
+            if outer:
+                with self.condition:
+                    stats = self.devices.setdefault(device, DeviceStats())
+                    stats.transactions += 1
+                    stats.bus_time += held
+                    stats.wait_time += started - requested
+                    if error is not None:
+                        stats.errors += 1
+                        stats.last_error = f"{type(error).__name__}: {error}"
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                "waiting": len(self.waiting),
+                "devices": {device: asdict(stats) for device, stats in self.devices.items()},
+            }
+
+class BusHandle:
+    '''
+    Stands in for an SMBus when handed to a device library: every call is made as a transaction
+    on the shared bus, with a deadline of one sensor period from when it was requested.
+    '''
+    def __init__(self, bus: I2CBus, device: str, priority: int = 0, period: float = 1.0):
+        self.bus = bus
+        self.device = device
+        self.priority = priority
+        self.period = period
+
+    def transaction(self):
+        '''For sequences of calls that must not be interleaved with other devices'''
+        return self.bus.transaction(self.device, self.priority, time.monotonic() + self.period)
+
+    @property
+    def msg(self):
+        '''smbus2's i2c_msg, for libraries written against grove.i2c.Bus'''
+        from smbus2 import i2c_msg
+        return i2c_msg
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.bus.smbus, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            with self.transaction():
+                return attribute(*args, **kwargs)
+        return call
+
+class BusManager:
+    '''Hands out handles to the I2C buses, opening each bus once for the whole process'''
+    def __init__(self):
+        self.buses: dict[int, I2CBus] = {}
+        self.lock = threading.Lock()
+
+    def get(self, number: int) -> I2CBus:
+        with self.lock:
+            if number not in self.buses:
+                self.buses[number] = I2CBus(number)
+            return self.buses[number]
+
+    def handle(self, config: I2CSensorConfig, address: int) -> BusHandle:
+        period = 1 / config.rate if config.rate > 0 else 1.0
+        return BusHandle(self.get(config.bus), f"{config.type}@0x{address:02x}", config.priority, period)
+
+    def stats(self) -> dict[int, dict]:
+        with self.lock:
+            buses = list(self.buses.values())
+        return {bus.number: bus.stats() for bus in buses}
+
+# Shared by every sensor and kept across settings reloads
+buses = BusManager()
@@ -1,24 +1,93 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import cv2
 import asyncio
-from typing import Union
+import logging
+import os
+import threading
+import time
+from typing import Optional, Union
 import simplejpeg as simplejpeg
 from pydantic import BaseModel
 from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
 from starlette.exceptions import HTTPException
 
+from components.recorder import CameraRecorder
+from util import v4l2
+
+class StreamVariant(BaseModel):
+    scale: float = 1.0
+    # Defaults to the camera's quality
+    quality: Optional[int] = None
+
+@dataclass(frozen=True)
+class StreamProfile:
+    quality: int
+    scale: float = 1.0
+
 class CameraParameters(BaseModel):
     source: Union[int, str]
     id: str
     framerate: int
-    width: int 
+    width: int
     height: int
     quality: int
+    # Let each viewer lower quality/resolution on its own when it can't keep up
+    adaptive: bool = True
+    # Forward MJPEG frames from the device as-is instead of decoding and re-encoding them
+    passthrough: bool = False
+    # Keep driver buffering to a minimum and only decode/encode the newest frame when a viewer is ready
+    low_latency: bool = False
+    # Skip frames whose mean pixel difference (0-255, on a small greyscale copy) from the last
+    # sent frame is below this. 0 disables change detection
+    change_threshold: float = 0
+    # Seconds between frames that are sent anyway while nothing changes
+    keepalive: float = 1.0
+    # Keep the last few minutes in the on-disk ring configured under [recorder]
+    record: bool = False
+    # Named resolutions viewers can pick with ?variant=, each encoded at most once per frame
+    variants: dict[str, StreamVariant] = {
+        "full": StreamVariant(),
+        "half": StreamVariant(scale=0.5),
+        "thumb": StreamVariant(scale=0.25),
+    }
+
+    def profile(self, variant: str = "full") -> StreamProfile:
+        if variant not in self.variants:
+            # The full resolution stream is always available
+            if variant == "full":
+                return StreamProfile(quality=self.quality)
+            raise KeyError(f"Unknown stream variant {variant}")
+        settings = self.variants[variant]
+        return StreamProfile(quality=settings.quality or self.quality, scale=settings.scale)
+
+@dataclass
+class Frame:
+    sequence: int
+    # Wall clock time the frame was grabbed from the device, for measuring glass-to-glass latency
+    timestamp: float
+    # Encoded JPEG for every profile that was requested when the frame was captured
+    images: dict[StreamProfile, bytes] = field(default_factory=dict)
+
+    def image(self, profile: StreamProfile) -> bytes:
+        # A viewer that only just changed profile gets whatever was encoded for this frame
+        return self.images.get(profile) or next(iter(self.images.values()))
 
 class Camera:
+    SAMPLE_SIZE = (32, 24)
+
     def __init__(self, parameters: CameraParameters):
+        self.logger = logging.getLogger(__name__)
         self.parameters = parameters
-        self.capture = cv2.VideoCapture(parameters.source) #, cv2.CAP_OPENCV_MJPEG)
+        # Profile that matches the device output when passing MJPEG frames straight through
+        self.native = parameters.profile()
+        self.passthrough = parameters.passthrough and isinstance(parameters.source, int)
+        if self.passthrough:
+            # MJPEG can only be requested from the V4L2 backend directly
+            self.capture = cv2.VideoCapture(parameters.source, cv2.CAP_V4L2)
+            self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        else:
+            self.capture = cv2.VideoCapture(parameters.source) #, cv2.CAP_OPENCV_MJPEG)
         # Resolution
         if parameters.width != 0 and parameters.height != 0:
             self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, parameters.width)
@@ -26,39 +95,551 @@ class Camera:
         # Framerate
         if parameters.framerate != 0:
             self.capture.set(cv2.CAP_PROP_FPS, parameters.framerate)
+        # Don't let the driver queue up frames that will be stale by the time they're read
+        if parameters.low_latency:
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
         # Try open camera
         if not self.capture.isOpened():
             raise RuntimeError("Could not start video.")
+        if self.passthrough and not self._enable_passthrough():
+            self.logger.warning(f"Camera {parameters.id} can't output MJPEG, falling back to encoding frames")
+            self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            self.passthrough = False
 
-    async def frames(self):
+    def _enable_passthrough(self) -> bool:
+        if int(self.capture.get(cv2.CAP_PROP_FOURCC)) != cv2.VideoWriter_fourcc(*"MJPG"):
+            return False
+        # Ask OpenCV for the raw buffer instead of decoding it to BGR
+        self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 0)
         ret, frame = self.capture.read()
+        # A compressed frame comes back as a single row of bytes starting with the JPEG SOI marker
+        return ret and frame.ndim <= 2 and frame.size > 2 and frame.reshape(-1)[:2].tobytes() == b"\xff\xd8"
+
+    def grab(self) -> float:
+        if not self.capture.grab():
+            raise RuntimeError("Could not read frame.")
+        return time.time()
+
+    def retrieve(self):
+        ret, frame = self.capture.retrieve()
+        if not ret:
+            raise RuntimeError("Could not read frame.")
+        if self.passthrough:
+            return frame.tobytes()
+        return frame
+
+    def sample(self, frame):
+        '''Tiny greyscale copy of a frame for cheap change detection'''
+        if self.passthrough:
+            # Decoding at 1/8 scale skips almost all of the JPEG work
+            frame = simplejpeg.decode_jpeg(frame, colorspace="GRAY", fastdct=True, min_width=1, min_height=1)
+            return cv2.resize(frame, self.SAMPLE_SIZE, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(cv2.resize(frame, self.SAMPLE_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+
+    def decode(self, data: bytes, scale: float = 1.0):
+        height, width, _, _ = simplejpeg.decode_jpeg_header(data)
+        width, height = round(width * scale), round(height * scale)
+        # libjpeg-turbo can do most of the downscaling while decoding
+        frame = simplejpeg.decode_jpeg(
+            data,
+            colorspace="BGR",
+            fastdct=True,
+            fastupsample=True,
+            min_width=width,
+            min_height=height,
+        )
+        if frame.shape[1] != width or frame.shape[0] != height:
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        return frame
+
+    def encode(self, frame, profile: StreamProfile) -> bytes:
+        if self.passthrough:
+            # Frames are already JPEG, only re-encode for viewers that need something different
+            if profile == self.native:
+                return frame
+            frame = self.decode(frame, profile.scale)
+        elif profile.scale != 1.0:
+            frame = cv2.resize(frame, None, fx=profile.scale, fy=profile.scale, interpolation=cv2.INTER_AREA)
         #frame_bytes = cv2.imencode(".jpg", frame)[1].tobytes()
         # Using simplejpeg should be much more performant than OpenCV for compressing JPGs
-        frame_bytes = simplejpeg.encode_jpeg(
+        return simplejpeg.encode_jpeg(
             frame,
-            quality=self.parameters.quality,
+            quality=profile.quality,
             colorspace="BGR",
             colorsubsampling="422",
             fastdct=True,
         )
-        yield frame_bytes
-        await asyncio.sleep(0)
 
-class CameraComponent:
+    def close(self):
+        self.capture.release()
+
+class StreamSubscriber:
+    '''
+    A single viewer of a camera. Holds only the newest frame: if the viewer hasn't sent the
+    previous frame by the time a new one arrives, the old one is dropped rather than queued.
+    '''
+    # Steps taken when a viewer falls behind, as (quality multiplier, scale)
+    ADAPTIVE_STEPS = ((1.0, 1.0), (0.75, 1.0), (0.5, 1.0), (0.5, 0.5), (0.5, 0.25))
+    # Fraction of frames dropped over a window before stepping down
+    DROP_THRESHOLD = 0.2
+    # Number of windows without drops before stepping back up
+    RECOVERY_WINDOWS = 3
+
+    def __init__(self, client: str, variant: str, base: StreamProfile, adaptive: bool, window: int, demand: threading.Event):
+        self.client = client
+        self.variant = variant
+        self.base = base
+        self.profile = base
+        self.adaptive = adaptive
+        self.window = window
+        # Signals the capture thread that this viewer is waiting for a frame
+        self.demand = demand
+        self.level = 0
+        self.sent = 0
+        self.dropped = 0
+        self.frame: Optional[Frame] = None
+        self.closed = False
+        self.ready = asyncio.Event()
+        self._offered = 0
+        self._window_dropped = 0
+        self._healthy = 0
+
+    def offer(self, frame: Frame):
+        if self.frame is not None:
+            self.dropped += 1
+            self._window_dropped += 1
+        self.frame = frame
+        self._offered += 1
+        self.ready.set()
+
+    async def get(self) -> Optional[Frame]:
+        if self.frame is None:
+            self.demand.set()
+        await self.ready.wait()
+        self.ready.clear()
+        if self.closed:
+            return None
+        frame, self.frame = self.frame, None
+        self.sent += 1
+        return frame
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    def adapt(self) -> bool:
+        '''Re-evaluate the profile once per window of offered frames. Returns True if it changed.'''
+        if not self.adaptive or self._offered < self.window:
+            return False
+        ratio = self._window_dropped / self._offered
+        self._offered = 0
+        self._window_dropped = 0
+        level = self.level
+        if ratio > self.DROP_THRESHOLD:
+            self._healthy = 0
+            level = min(level + 1, len(self.ADAPTIVE_STEPS) - 1)
+        elif ratio == 0:
+            self._healthy += 1
+            if self._healthy >= self.RECOVERY_WINDOWS:
+                self._healthy = 0
+                level = max(level - 1, 0)
+        else:
+            self._healthy = 0
+        if level == self.level:
+            return False
+        self.level = level
+        quality, scale = self.ADAPTIVE_STEPS[level]
+        self.profile = StreamProfile(
+            quality=max(10, round(self.base.quality * quality)),
+            scale=self.base.scale * scale,
+        )
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "client": self.client,
+            "variant": self.variant,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "level": self.level,
+            "quality": self.profile.quality,
+            "scale": self.profile.scale,
+        }
+
+class CameraBroadcaster:
+    '''
+    Owns the single capture for a camera and fans each encoded frame out to every subscriber.
+    The capture is opened for the first subscriber and released once the last one leaves.
+
+    Grabbing and encoding happen on a dedicated thread per camera so that the event loop
+    (and with it the drive and arm endpoints) never waits on the device. Each frame is encoded
+    once per distinct profile requested by the current subscribers and handed back to the loop.
+    '''
+    # Seconds a snapshot keeps the capture open, so clients polling for stills reuse it
+    SNAPSHOT_LEASE = 5.0
+    # Seconds before trying to restart a recording after the capture failed
+    RECORD_RETRY = 5.0
+
+    def __init__(self, parameters: CameraParameters, recorder: Optional[CameraRecorder] = None):
+        self.logger = logging.getLogger(__name__)
+        self.parameters = parameters
+        self.recorder = recorder
+        # Profile of the frames handed to the recorder, the variant is checked when settings are loaded
+        self.recorded = parameters.profile(recorder.config.variant) if recorder is not None else None
+        self.record_task: Optional[asyncio.Task] = None
+        # Set once the broadcaster has been replaced, e.g. by reloading settings
+        self.closed = False
+        self.subscribers: set[StreamSubscriber] = set()
+        # Profiles the capture thread should encode, replaced as a whole whenever it changes
+        self.profiles: frozenset[StreamProfile] = frozenset()
+        self.sequence = 0
+        # Frames that were captured but not sent because nothing changed
+        self.unchanged = 0
+        # Distinguishes frame sequence numbers from those of an earlier broadcaster for the same camera
+        self.epoch = format(time.time_ns() // 1_000_000, "x")
+        self.latest: Optional[Frame] = None
+        # Snapshot subscribers per variant, and the timers that release them
+        self.leases: dict[str, StreamSubscriber] = {}
+        self.lease_timers: dict[str, asyncio.TimerHandle] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.demand = threading.Event()
+        self.passthrough = False
+        self.lock = asyncio.Lock()
+        self.snapshot_lock = asyncio.Lock()
+
+    async def subscribe(self, client: str = "", variant: str = "full", adaptive: Optional[bool] = None) -> StreamSubscriber:
+        # Raises KeyError for unknown variants before touching the device
+        base = self.parameters.profile(variant)
+        async with self.lock:
+            if self.thread is None or self.stopping.is_set():
+                await self._start()
+            subscriber = StreamSubscriber(
+                client=client,
+                variant=variant,
+                base=base,
+                adaptive=self.parameters.adaptive if adaptive is None else adaptive,
+                window=self.parameters.framerate or 30,
+                demand=self.demand,
+            )
+            self.subscribers.add(subscriber)
+            self._update_profiles()
+            return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber):
+        self.subscribers.discard(subscriber)
+        self._update_profiles()
+        if not self.subscribers:
+            self.stop()
+
+    async def snapshot(self, variant: str = "full") -> Optional[Frame]:
+        '''Most recent frame, starting a short-lived capture if nobody is streaming'''
+        profile = self.parameters.profile(variant)
+        async with self.snapshot_lock:
+            lease = self.leases.get(variant)
+            if lease is None or lease.closed:
+                lease = self.leases[variant] = await self.subscribe("snapshot", variant, adaptive=False)
+            if variant in self.lease_timers:
+                self.lease_timers[variant].cancel()
+            self.lease_timers[variant] = self.loop.call_later(self.SNAPSHOT_LEASE, self._release_lease, variant)
+            frame = self.latest
+            # Wait for a frame that was encoded for this variant
+            while frame is None or profile not in frame.images:
+                frame = await lease.get()
+                if frame is None:
+                    return None
+            return frame
+
+    def start_recording(self):
+        if self.recorder is not None and self.record_task is None:
+            self.record_task = asyncio.create_task(self._record())
+
+    async def _record(self):
+        # Holding a subscription keeps the capture running (and encoding the recorded variant)
+        # while nobody is watching. The frames themselves are handed to the recorder by the
+        # capture thread, so a busy event loop can't make the recording skip frames.
+        while not self.closed:
+            try:
+                subscriber = await self.subscribe("recorder", self.recorder.config.variant, adaptive=False)
+            except Exception as e:
+                self.logger.error(f"Could not start recording camera {self.parameters.id}: {e}")
+            else:
+                try:
+                    while await subscriber.get() is not None:
+                        pass
+                finally:
+                    self.unsubscribe(subscriber)
+            if not self.closed:
+                await asyncio.sleep(self.RECORD_RETRY)
+
+    def etag(self, frame: Frame, variant: str = "full") -> str:
+        return f'"{self.parameters.id}-{variant}-{self.epoch}-{frame.sequence}"'
+
+    def _release_lease(self, variant: str):
+        lease = self.leases.pop(variant, None)
+        self.lease_timers.pop(variant, None)
+        if lease is not None:
+            self.unsubscribe(lease)
+
+    async def _start(self):
+        self.loop = asyncio.get_running_loop()
+        # Let a previous capture thread release the device before opening it again
+        if self.thread is not None:
+            await self.loop.run_in_executor(None, self.thread.join)
+        # Opening a device can take a while, so it is done off the loop as well.
+        # Raises if the device can't be opened, leaving the broadcaster idle
+        camera = await self.loop.run_in_executor(None, Camera, self.parameters)
+        self.passthrough = camera.passthrough
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            target=self._capture,
+            args=(camera, self.stopping),
+            name=f"camera-{self.parameters.id}",
+            daemon=True,
+        )
+        self.thread.start()
+        self.logger.info(f"Started capture for camera {self.parameters.id}")
+
+    def stop(self):
+        '''Stop capturing and end every open stream. Safe to call from any thread.'''
+        self.stopping.set()
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._close_subscribers)
+            except RuntimeError:
+                # Event loop already closed
+                pass
+
+    def close(self):
+        '''Stop for good, including any recording. Safe to call from any thread.'''
+        self.closed = True
+        self.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def stats(self) -> dict:
+        return {
+            "recording": self.recorder.stats() if self.recorder is not None else None,
+            "running": self.thread is not None and not self.stopping.is_set(),
+            "frames": self.sequence,
+            "unchanged": self.unchanged,
+            "saved_ratio": round(self.unchanged / max(self.unchanged + self.sequence, 1), 3),
+            "passthrough": self.passthrough,
+            "subscribers": [subscriber.stats() for subscriber in self.subscribers],
+        }
+
+    def _update_profiles(self):
+        self.profiles = frozenset(subscriber.profile for subscriber in self.subscribers)
+
+    def _capture(self, camera: Camera, stopping: threading.Event):
+        # Sample of the last frame that was sent, for change detection
+        reference = None
+        sent_at = 0.0
+        try:
+            while not stopping.is_set():
+                timestamp = camera.grab()
+                # In low latency mode the driver is drained continuously, but a frame is only
+                # decoded and encoded once a viewer is ready to send it
+                if self.parameters.low_latency:
+                    if not self.demand.is_set():
+                        continue
+                    self.demand.clear()
+                image = camera.retrieve()
+                if self.parameters.change_threshold > 0:
+                    sample = camera.sample(image)
+                    changed = reference is None or cv2.absdiff(sample, reference).mean() >= self.parameters.change_threshold
+                    if not changed and timestamp - sent_at < self.parameters.keepalive:
+                        self.unchanged += 1
+                        # The viewer that asked for this frame is still waiting
+                        if self.parameters.low_latency:
+                            self.demand.set()
+                        continue
+                    reference = sample
+                    sent_at = timestamp
+                self.sequence += 1
+                frame = Frame(sequence=self.sequence, timestamp=timestamp)
+                for profile in self.profiles or {self.parameters.profile()}:
+                    frame.images[profile] = camera.encode(image, profile)
+                if self.recorder is not None:
+                    self.recorder.record(frame.sequence, frame.timestamp, frame.image(self.recorded))
+                self.loop.call_soon_threadsafe(self._publish, frame)
+        except Exception as e:
+            self.logger.error(f"Capture for camera {self.parameters.id} failed: {e}")
+            self.stop()
+        finally:
+            camera.close()
+            self.logger.info(f"Stopped capture for camera {self.parameters.id}")
+
+    def _publish(self, frame: Frame):
+        # Frame from a capture that has since been stopped
+        if self.stopping.is_set():
+            return
+        self.latest = frame
+        # The same encoded bytes are handed to every subscriber sharing a profile
+        changed = False
+        for subscriber in self.subscribers:
+            subscriber.offer(frame)
+            changed = subscriber.adapt() or changed
+        if changed:
+            self._update_profiles()
+
+    def _close_subscribers(self):
+        # Wake up any remaining viewers so their responses can finish
+        for subscriber in self.subscribers:
+            subscriber.close()
+        self.subscribers.clear()
+        self.latest = None
+        self._update_profiles()
+
+class CameraDevice(BaseModel):
+    index: int
+    path: str
+    name: str
+    driver: Optional[str] = None
+    bus: Optional[str] = None
+    # Pixel format (e.g. MJPG, YUYV) to supported resolutions
+    formats: dict[str, list[str]] = {}
+
+class CameraDiscovery:
+    '''
+    Cached list of capture devices. Devices are enumerated from /dev/video* and sysfs without
+    starting a stream, and only enumerated again when the set of device nodes changes
+    (i.e. something was plugged in or removed) or a rescan is requested.
+    '''
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.signature = None
+        self.devices: list[CameraDevice] = []
+
+    def available(self, rescan: bool = False) -> list[CameraDevice]:
+        signature = self._signature()
+        with self.lock:
+            if rescan or signature != self.signature:
+                self.devices = self._scan()
+                self.signature = signature
+                self.logger.info(f"Found {len(self.devices)} camera devices")
+            return self.devices
+
+    @staticmethod
+    def _signature():
+        signature = []
+        for path in v4l2.device_paths():
+            try:
+                signature.append((path, os.stat(path).st_ctime_ns))
+            except OSError:
+                pass
+        return tuple(signature)
+
+    @staticmethod
+    def _scan() -> list[CameraDevice]:
+        if not os.path.isdir("/sys/class/video4linux"):
+            return CameraDiscovery._probe()
+        devices = []
+        for path in v4l2.device_paths():
+            info = v4l2.query(path)
+            if info is not None:
+                devices.append(CameraDevice(index=v4l2.device_index(path), path=path, **info))
+        return devices
+
     @staticmethod
-    def list_available():
-        # checks the first 10 indexes.
-        index = 0
-        arr = []
-        i = 10
-        while i > 0:
+    def _probe() -> list[CameraDevice]:
+        # Systems without V4L2 can only be probed by opening the first few indexes
+        devices = []
+        for index in range(10):
             cap = cv2.VideoCapture(index)
             if cap.read()[0]:
-                arr.append(index)
-                cap.release()
-            index += 1
-            i -= 1
-        return arr
+                devices.append(CameraDevice(index=index, path=str(index), name=f"Camera {index}"))
+            cap.release()
+        return devices
+
+class CameraComponent:
+    discovery = CameraDiscovery()
+
+    @staticmethod
+    def list_available(rescan: bool = False) -> list[CameraDevice]:
+        return CameraComponent.discovery.available(rescan)
+
+    @staticmethod
+    async def stats(request: Request):
+        camera_id: str = request.path_params['id']
+        if camera_id not in request.app.state.streams:
+            raise HTTPException(404)
+        return JSONResponse(request.app.state.streams[camera_id].stats())
+
+    @staticmethod
+    async def snapshot(request: Request):
+        camera_id: str = request.path_params['id']
+        if camera_id not in request.app.state.streams:
+            raise HTTPException(404)
+        broadcaster: CameraBroadcaster = request.app.state.streams[camera_id]
+        variant = request.query_params.get("variant", "full")
+        if variant != "full" and variant not in broadcaster.parameters.variants:
+            raise HTTPException(400, f"Unknown stream variant {variant}")
+        try:
+            frame = await broadcaster.snapshot(variant)
+        except Exception:
+            raise HTTPException(503, "Could not start video.")
+        if frame is None:
+            raise HTTPException(503, "Could not read frame.")
+
+        etag = broadcaster.etag(frame, variant)
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Timestamp": f"{frame.timestamp:.6f}"}
+        # Polling clients that already have this frame don't need it again
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        image = frame.image(broadcaster.parameters.profile(variant))
+        return Response(image, media_type="image/jpeg", headers=headers)
+
+    @staticmethod
+    def _recorder(request: Request) -> CameraRecorder:
+        camera_id: str = request.path_params['id']
+        if camera_id not in request.app.state.streams:
+            raise HTTPException(404)
+        recorder = request.app.state.streams[camera_id].recorder
+        if recorder is None:
+            raise HTTPException(404, f"Camera {camera_id} is not being recorded")
+        return recorder
+
+    @staticmethod
+    async def recording(request: Request):
+        return JSONResponse(CameraComponent._recorder(request).stats())
+
+    @staticmethod
+    async def export(request: Request):
+        '''
+        Recorded frames between ?from= and ?to= (seconds since the epoch). Returned as a
+        Motion JPEG file, or with ?replay=true as a stream at the speed they were recorded.
+        '''
+        recorder = CameraComponent._recorder(request)
+        try:
+            start = float(request.query_params.get("from", 0))
+            end = float(request.query_params.get("to", "inf"))
+        except ValueError:
+            raise HTTPException(400, "from and to must be timestamps")
+
+        if request.query_params.get("replay", "false").lower() in ("1", "true", "yes"):
+            def parts():
+                for timestamp, image in recorder.replay(start, end):
+                    yield b"".join([
+                        b"--frame\r\n",
+                        b"Content-Type: image/jpeg\r\n",
+                        f"X-Timestamp: {timestamp:.6f}\r\n\r\n".encode(),
+                        image,
+                        b"\r\n",
+                    ])
+            return StreamingResponse(parts(), media_type="multipart/x-mixed-replace; boundary=frame")
+
+        # Concatenated JPEGs are a valid Motion JPEG file
+        images = (image for _, image in recorder.frames(start, end))
+        filename = f"{request.path_params['id']}-{int(start)}.mjpeg"
+        return StreamingResponse(
+            images,
+            media_type="video/x-motion-jpeg",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
 
     @staticmethod
     async def stream(scope, receive, send):
@@ -66,32 +647,46 @@ class CameraComponent:
         request = Request(scope, receive)
 
         camera_id: str = request.path_params['id']
-        try:
-            camera = Camera(request.app.state.cameras[camera_id])
-        except:
+        client = f"{request.client.host}:{request.client.port}" if request.client else ""
+        variant = request.query_params.get("variant", "full")
+        if camera_id not in request.app.state.streams:
             raise HTTPException(404)
-        
-        if message["type"] == "http.request":
-            await send(
-                {
-                    "type": "http.response.start",
-                    "status": 200,
-                    "headers": [
-                        [b"Content-Type", b"multipart/x-mixed-replace; boundary=frame"]
-                    ],
-                }
-            )
-            while not receive.__self__.disconnected:
-                async for frame in camera.frames():
+        broadcaster: CameraBroadcaster = request.app.state.streams[camera_id]
+        try:
+            subscriber = await broadcaster.subscribe(client, variant)
+        except KeyError:
+            raise HTTPException(400, f"Unknown stream variant {variant}")
+        except Exception:
+            raise HTTPException(503, "Could not start video.")
+
+        try:
+            if message["type"] == "http.request":
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": 200,
+                        "headers": [
+                            [b"Content-Type", b"multipart/x-mixed-replace; boundary=frame"]
+                        ],
+                    }
+                )
+                while not receive.__self__.disconnected:
+                    frame = await subscriber.get()
+                    # Capture has stopped
+                    if frame is None:
+                        break
                     data = b"".join(
                         [
                             b"--frame\r\n",
-                            b"Content-Type: image/jpeg\r\n\r\n",
-                            frame,
+                            b"Content-Type: image/jpeg\r\n",
+                            f"X-Frame-Sequence: {frame.sequence}\r\n".encode(),
+                            f"X-Timestamp: {frame.timestamp:.6f}\r\n\r\n".encode(),
+                            frame.image(subscriber.profile),
                             b"\r\n",
                         ]
                     )
                     await send(
                         {"type": "http.response.body", "body": data, "more_body": True}
                     )
-                
\ No newline at end of file
+        finally:
+            broadcaster.unsubscribe(subscriber)
@@ -1,6 +1,7 @@
 from dataclasses import dataclass, field
-from typing import Any
+from typing import Any, Optional
 import logging
+import threading
 
 from dataclasses import dataclass
 
@@ -35,45 +36,178 @@ class DummyConnection(Drive):
     def close(self):
         logger.info("Closing...")
 
+class DriveProtocol:
+    '''
+    Encodes motor commands for a motor controller. Speeds are -1000 to 1000, and motors are
+    the controller's own motor numbers (the values under [drive.channels]).
+    '''
+    def encode(self, motor: int, speed: int) -> bytes:
+        pass
+
+    def stop(self) -> bytes:
+        pass
+
+    # Used by the simulator: parses commands from the start of data, returning them as
+    # (motor, speed) with None for stop, and how many bytes were consumed
+    def decode(self, data: bytes) -> tuple[list[tuple[Optional[int], int]], int]:
+        pass
+
+class SimplifiedSerialProtocol(DriveProtocol):
+    '''
+    Sabertooth style simplified serial: one byte per command, centred on the motor's stop
+    value, and a single 0 byte stops every motor.
+    '''
+    # Motor to its (stop value, lowest, highest) byte
+    MOTORS = {
+        0: (64, 1, 127),
+        1: (192, 128, 255),
+    }
+    # Bytes either side of the stop value at full speed
+    SPAN = 62
+
+    def encode(self, motor: int, speed: int) -> bytes:
+        centre, lowest, highest = self.MOTORS[motor]
+        return bytes([max(lowest, min(highest, centre + round(self.SPAN / 1000 * speed)))])
+
+    def stop(self) -> bytes:
+        return bytes([0])
+
+    def decode(self, data: bytes) -> tuple[list[tuple[Optional[int], int]], int]:
+        commands = []
+        for value in data:
+            if value == 0:
+                commands.append((None, 0))
+                continue
+            for motor, (centre, lowest, highest) in self.MOTORS.items():
+                if lowest <= value <= highest:
+                    commands.append((motor, round((value - centre) * 1000 / self.SPAN)))
+        return commands, len(data)
+
+class PacketizedSerialProtocol(DriveProtocol):
+    '''
+    Sabertooth packetized serial: address, command, data (0-127) and a 7 bit checksum, so
+    several controllers can share a line.
+    '''
+    # Motor to its (forward, backward) command
+    COMMANDS = {
+        0: (0, 1),
+        1: (4, 5),
+    }
+    PACKET = 4
+
+    def __init__(self, address: int = 128):
+        self.address = address
+
+    def packet(self, command: int, data: int) -> bytes:
+        return bytes([self.address, command, data, (self.address + command + data) & 0x7F])
+
+    def encode(self, motor: int, speed: int) -> bytes:
+        forward, backward = self.COMMANDS[motor]
+        return self.packet(forward if speed >= 0 else backward, min(127, round(127 / 1000 * abs(speed))))
+
+    def stop(self) -> bytes:
+        return b"".join(self.packet(forward, 0) for forward, _ in self.COMMANDS.values())
+
+    def decode(self, data: bytes) -> tuple[list[tuple[Optional[int], int]], int]:
+        commands = []
+        position = 0
+        while len(data) - position >= self.PACKET:
+            address, command, value, checksum = data[position:position + self.PACKET]
+            if address != self.address or (address + command + value) & 0x7F != checksum:
+                # Out of step, resynchronise on the next byte
+                position += 1
+                continue
+            position += self.PACKET
+            for motor, (forward, backward) in self.COMMANDS.items():
+                if command in (forward, backward):
+                    speed = round(value * 1000 / 127)
+                    commands.append((motor, speed if command == forward else -speed))
+        return commands, position
+
+PROTOCOLS: dict[str, type[DriveProtocol]] = {
+    "simplified": SimplifiedSerialProtocol,
+    "packetized": PacketizedSerialProtocol,
+}
+
 class SimpleSerialConnection(Drive):
-    def __init__(self, port: str, baudrate: int, channels):
+    '''
+    Drives a motor controller over a serial port, with the bytes produced by a DriveProtocol.
+
+    The port is owned by a writer thread. Commands only replace the pending setpoint for their
+    channel, and the thread writes whatever is newest for both channels in one write, skipping
+    channels whose command hasn't changed, then waits for it to go out before taking the next.
+    Setpoints that arrive while a write is in flight are coalesced instead of queueing up in the
+    UART. stop() discards pending setpoints and anything not yet transmitted.
+    '''
+    # Drive channel to its name under [drive.channels]
+    SIDES = {0: 'left', 1: 'right'}
+
+    def __init__(self, port: str, baudrate: int, channels, protocol: Optional[DriveProtocol] = None):
         import serial
         self.port = port
         self.baudrate = baudrate
         self.channels = channels
+        self.protocol = protocol or SimplifiedSerialProtocol()
         self.serial = serial.Serial(port=self.port, baudrate=self.baudrate)
+        self.condition = threading.Condition()
+        # Channel (0 left, 1 right) to the newest command not yet written
+        self.pending: dict[int, bytes] = {}
+        # Last command written to each channel
+        self.written: dict[int, bytes] = {}
+        self.stop_requested = False
+        self.closed = False
+        self.thread = threading.Thread(target=self._write, name="drive-writer", daemon=True)
+        self.thread.start()
+
+    def _set(self, speeds: dict[int, int]):
+        # Note channels > 1 are intentionally ignored
+        commands = {
+            channel: self.protocol.encode(self.channels.get(self.SIDES[channel]), speed)
+            for channel, speed in speeds.items() if channel in self.SIDES and speed is not None
+        }
+        with self.condition:
+            self.pending.update(commands)
+            self.condition.notify()
 
     def move_motor(self, channel: int, speed: int):
-        # Left channel
-        if channel == 0:
-            offset = 64 #if speed > 0 else 0
-            channel = self.channels.get('left') * 128
-            msg = offset + channel + abs(round(62 / 1000 * speed))
-            self.serial.write(bytes([msg]))
-        # Right channel, note the intentional use of elif, since we want to ignore channels > 1
-        elif channel == 1:
-            offset = 64 #if speed > 0 else 0
-            channel = self.channels.get('right') * 128
-            msg = offset + channel + abs(round(62 / 1000 * speed))
-            self.serial.write(bytes([msg]))
+        self._set({channel: speed})
 
     def move(self, speed: list[int]):
-        # Left side
-        if speed[0] is not None:
-            offset = 64 #if speed[0] > 0 else 0
-            channel = self.channels.get('left') * 128
-            msg = offset + channel + (round(62 / 1000 * speed[0]))
-            self.serial.write(bytes([msg]))
-        # Right side
-        if speed[1] is not None:
-            offset = 64 #if speed[1] > 0 else 0
-            channel = self.channels.get('right') * 128
-            msg = offset + channel + (round(62 / 1000 * speed[1]))
-            self.serial.write(bytes([msg]))
+        self._set({0: speed[0], 1: speed[1]})
 
     def stop(self):
-        self.serial.write(bytes([0]))
+        with self.condition:
+            self.pending.clear()
+            self.stop_requested = True
+            self.condition.notify()
 
     def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join(timeout=1)
         self.serial.close()
 
+    def _write(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stop_requested and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                stop, self.stop_requested = self.stop_requested, False
+                commands, self.pending = self.pending, {}
+            try:
+                if stop:
+                    # Drop anything still waiting to be transmitted
+                    self.serial.reset_output_buffer()
+                    self.serial.write(self.protocol.stop())
+                    self.written.clear()
+                changed = {channel: command for channel, command in commands.items() if self.written.get(channel) != command}
+                if changed:
+                    self.serial.write(b"".join(changed[channel] for channel in sorted(changed)))
+                    self.written.update(changed)
+                # Wait until it's sent, so newer setpoints replace older ones here rather than queue in the UART
+                self.serial.flush()
+            except Exception as e:
+                logger.error(f"Writing to drive failed: {e}")
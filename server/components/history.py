@@ -0,0 +1,90 @@
+import threading
+from array import array
+from numbers import Real
+from typing import Any
+
+class ChannelHistory:
+    '''Fixed-size ring of timestamped values for one numeric channel'''
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        # Preallocated so memory use never changes after the first sample
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.count = 0
+        # Index the next sample is written to
+        self.head = 0
+
+    def append(self, timestamp: float, value: float):
+        self.timestamps[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def ordered(self) -> tuple[array, array]:
+        '''Copies of the stored timestamps and values, oldest first'''
+        if self.count < self.capacity:
+            return self.timestamps[:self.count], self.values[:self.count]
+        return (
+            self.timestamps[self.head:] + self.timestamps[:self.head],
+            self.values[self.head:] + self.values[:self.head],
+        )
+
+class SensorHistory:
+    '''
+    Recent readings of a sensor, kept per numeric channel: the reading itself for scalar
+    sensors, or each numeric field for sensors that return a dict.
+    '''
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.channels: dict[str, ChannelHistory] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def numeric(value: Any) -> bool:
+        return isinstance(value, Real) and not isinstance(value, bool)
+
+    def record(self, timestamp: float, value: Any):
+        if self.numeric(value):
+            fields = {"value": value}
+        elif isinstance(value, dict):
+            fields = {key: field for key, field in value.items() if self.numeric(field)}
+        else:
+            # Frames and other non-scalar readings aren't kept
+            return
+        with self.lock:
+            for key, field in fields.items():
+                if key not in self.channels:
+                    self.channels[key] = ChannelHistory(self.capacity)
+                self.channels[key].append(timestamp, float(field))
+
+    def query(self, start: float, end: float, points: int) -> dict[str, dict[str, list[float]]]:
+        '''
+        Readings between start and end, reduced to at most `points` equally sized time buckets
+        per channel. Each bucket has its start time and the min, max and mean of its readings.
+        '''
+        import numpy as np
+
+        with self.lock:
+            channels = {key: channel.ordered() for key, channel in self.channels.items()}
+        edges = np.linspace(start, end, points + 1)
+        result = {}
+        for key, (timestamps, values) in channels.items():
+            timestamps = np.frombuffer(timestamps, dtype=np.float64)
+            values = np.frombuffer(values, dtype=np.float64)
+            first = np.searchsorted(timestamps, start, side="left")
+            last = np.searchsorted(timestamps, end, side="right")
+            timestamps, values = timestamps[first:last], values[first:last]
+            if len(values) == 0:
+                result[key] = {"t": [], "min": [], "max": [], "mean": []}
+                continue
+            # Index of the first reading in each bucket, skipping empty buckets
+            bucket = np.clip(np.searchsorted(edges, timestamps, side="right") - 1, 0, points - 1)
+            starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+            counts = np.diff(np.append(starts, len(values)))
+            result[key] = {
+                "t": edges[bucket[starts]].tolist(),
+                "min": np.minimum.reduceat(values, starts).tolist(),
+                "max": np.maximum.reduceat(values, starts).tolist(),
+                "mean": (np.add.reduceat(values, starts) / counts).tolist(),
+            }
+        return result
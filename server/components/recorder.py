@@ -0,0 +1,237 @@
+import bisect
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Iterator, Optional
+
+from pydantic import BaseModel
+
+class RecorderConfig(BaseModel):
+    directory: str = "~/.cache/sights-recordings"
+    # The ring for each camera is segments * segment_size MiB on disk
+    segments: int = 16
+    segment_size: int = 32
+    variant: str = "full"
+    # Frames waiting to be written before new ones are dropped
+    backlog: int = 64
+
+# Written before every frame: magic, sequence, capture timestamp, JPEG length
+RECORD = struct.Struct("<4sQdI")
+RECORD_MAGIC = b"SFRM"
+# One entry per frame in a segment's index file: capture timestamp, offset, JPEG length
+INDEX = struct.Struct("<dQI")
+
+class Segment:
+    '''
+    A preallocated file in the ring. Frames are appended sequentially and the
+    index file next to it records where each one starts.
+    '''
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.size = size
+        self.index_path = path.with_suffix(".idx")
+        self.timestamps = array("d")
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.position = 0
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size != size:
+            # Allocate the whole segment up front so recording never grows files
+            os.ftruncate(self.fd, 0)
+            try:
+                os.posix_fallocate(self.fd, 0, size)
+            except (AttributeError, OSError):
+                os.ftruncate(self.fd, size)
+            self.index = open(self.index_path, "wb")
+        else:
+            self._load_index()
+            self.index = open(self.index_path, "ab")
+
+    def _load_index(self):
+        try:
+            data = self.index_path.read_bytes()
+        except OSError:
+            return
+        # Ignore a partially written last entry
+        for timestamp, offset, length in INDEX.iter_unpack(data[:len(data) - len(data) % INDEX.size]):
+            self.timestamps.append(timestamp)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+        if self.offsets:
+            self.position = self.offsets[-1] + self.lengths[-1]
+
+    @property
+    def start(self) -> Optional[float]:
+        return self.timestamps[0] if self.timestamps else None
+
+    @property
+    def end(self) -> Optional[float]:
+        return self.timestamps[-1] if self.timestamps else None
+
+    def reset(self):
+        self.timestamps = array("d")
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.position = 0
+        self.index.close()
+        self.index = open(self.index_path, "wb")
+
+    def append(self, frames: list[tuple[int, float, bytes]]):
+        '''Writes the frames as one contiguous block, the caller checks they fit'''
+        block = bytearray()
+        entries = bytearray()
+        for sequence, timestamp, image in frames:
+            offset = self.position + len(block) + RECORD.size
+            block += RECORD.pack(RECORD_MAGIC, sequence, timestamp, len(image))
+            block += image
+            entries += INDEX.pack(timestamp, offset, len(image))
+            self.timestamps.append(timestamp)
+            self.offsets.append(offset)
+            self.lengths.append(len(image))
+        os.pwrite(self.fd, block, self.position)
+        self.index.write(entries)
+        self.index.flush()
+        self.position += len(block)
+
+    def read(self, offset: int, length: int) -> bytes:
+        return os.pread(self.fd, length, offset)
+
+    def close(self):
+        self.index.close()
+        os.close(self.fd)
+
+class CameraRecorder:
+    '''
+    Keeps the last few minutes of a camera in a fixed-size ring of segment files.
+
+    Frames are the JPEGs the broadcaster already encoded. The capture thread only puts them in a
+    bounded queue (dropping them if the disk can't keep up), and a writer thread appends whatever
+    has queued up to the current segment in a single write, moving on to the oldest segment when
+    it is full.
+    '''
+    def __init__(self, camera_id: str, config: RecorderConfig):
+        self.logger = logging.getLogger(__name__)
+        self.camera_id = camera_id
+        self.config = config
+        self.directory = Path(config.directory).expanduser() / camera_id
+        self.directory.mkdir(parents=True, exist_ok=True)
+        size = config.segment_size * 1024 * 1024
+        self.segments = [Segment(self.directory / f"segment-{i:03}.bin", size) for i in range(config.segments)]
+        # Carry on after the most recently written segment
+        recorded = [s for s in self.segments if s.end is not None]
+        self.current = self.segments.index(max(recorded, key=lambda s: s.end)) if recorded else 0
+        self.queue: queue.Queue = queue.Queue(maxsize=config.backlog)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._write, name=f"recorder-{camera_id}", daemon=True)
+        self.thread.start()
+
+    def record(self, sequence: int, timestamp: float, image: bytes):
+        '''Never blocks, called from the capture thread'''
+        try:
+            self.queue.put_nowait((sequence, timestamp, image))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Wait for queued frames to be written, a new recorder may open the same files
+        self.queue.put(None)
+        self.thread.join()
+
+    def _write(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            # Write everything that queued up while the last batch was being written
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = batch[:batch.index(None)]
+            try:
+                self._append(batch)
+            except OSError as e:
+                self.logger.error(f"Recording for camera {self.camera_id} failed: {e}")
+        for segment in self.segments:
+            segment.close()
+
+    def _append(self, batch: list[tuple[int, float, bytes]]):
+        while batch:
+            segment = self.segments[self.current]
+            fits = []
+            position = segment.position
+            for frame in batch:
+                position += RECORD.size + len(frame[2])
+                if position > segment.size:
+                    break
+                fits.append(frame)
+            with self.lock:
+                if fits:
+                    segment.append(fits)
+                    self.written += len(fits)
+                    batch = batch[len(fits):]
+                if batch:
+                    if not segment.timestamps:
+                        # Frame doesn't even fit in an empty segment
+                        self.dropped += 1
+                        batch = batch[1:]
+                        continue
+                    # Overwrite the oldest segment
+                    self.current = (self.current + 1) % len(self.segments)
+                    self.segments[self.current].reset()
+
+    def stats(self) -> dict:
+        with self.lock:
+            recorded = [s for s in self.segments if s.start is not None]
+            return {
+                "start": min((s.start for s in recorded), default=None),
+                "end": max((s.end for s in recorded), default=None),
+                "frames": sum(len(s.timestamps) for s in recorded),
+                "written": self.written,
+                "dropped": self.dropped,
+            }
+
+    def frames(self, start: float, end: float) -> Iterator[tuple[float, bytes]]:
+        '''Recorded frames with a capture time between start and end, oldest first'''
+        with self.lock:
+            ranges = []
+            for segment in sorted(self.segments, key=lambda s: s.start or 0):
+                if segment.start is None or segment.end < start or segment.start > end:
+                    continue
+                first = bisect.bisect_left(segment.timestamps, start)
+                last = bisect.bisect_right(segment.timestamps, end)
+                ranges.append((
+                    segment,
+                    segment.timestamps[first:last],
+                    segment.offsets[first:last],
+                    segment.lengths[first:last],
+                ))
+        for segment, timestamps, offsets, lengths in ranges:
+            for timestamp, offset, length in zip(timestamps, offsets, lengths):
+                header = segment.read(offset - RECORD.size, RECORD.size)
+                magic, _, recorded_at, _ = RECORD.unpack(header)
+                # The segment has been overwritten since the index was read
+                if magic != RECORD_MAGIC or recorded_at != timestamp:
+                    break
+                yield timestamp, segment.read(offset, length)
+
+    def replay(self, start: float, end: float) -> Iterator[tuple[float, bytes]]:
+        '''Like frames(), but paced at the speed they were recorded'''
+        began = time.monotonic()
+        first = None
+        for timestamp, image in self.frames(start, end):
+            if first is None:
+                first = timestamp
+            delay = (timestamp - first) - (time.monotonic() - began)
+            if delay > 0:
+                time.sleep(delay)
+            yield timestamp, image
@@ -0,0 +1,56 @@
+import importlib
+import logging
+import threading
+from importlib.metadata import entry_points
+from typing import Optional
+
+from components.sensor import Sensor
+
+# Sensor types that ship with Sights, as "module:Class"
+BUILTIN_SENSORS = {
+    "mlx90614": "sensors.mlx90614:MLX90614Sensor",
+    "mlx90640": "sensors.mlx90640:MLX90640Sensor",
+    "mlx90641": "sensors.mlx90641:MLX90641Sensor",
+    "random": "sensors.random_sensor:RandomSensor",
+    "sgp30": "sensors.sgp30:SGP30Sensor",
+    "system_info": "sensors.system_info:SystemInfo",
+    "thermal_analytics": "sensors.thermal_analytics:ThermalAnalyticsSensor",
+}
+
+class SensorRegistry:
+    '''
+    Finds the Sensor class for a sensor type, importing its module only when it is first needed.
+
+    Types are looked up in the `module` setting of the sensor ("package.module:Class"), then the
+    built in sensors, then packages that register a "sights.sensors" entry point named after the type.
+    '''
+    ENTRY_POINT_GROUP = "sights.sensors"
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.classes: dict[str, type[Sensor]] = {}
+        self.lock = threading.Lock()
+
+    def load(self, sensor_type: str, module: Optional[str] = None) -> type[Sensor]:
+        path = module or BUILTIN_SENSORS.get(sensor_type)
+        key = path or sensor_type
+        with self.lock:
+            if key not in self.classes:
+                self.classes[key] = self._import(path) if path else self._entry_point(sensor_type)
+                self.logger.info(f"Loaded sensor type {sensor_type} from {self.classes[key].__module__}")
+            return self.classes[key]
+
+    @staticmethod
+    def _import(path: str) -> type[Sensor]:
+        module_name, _, class_name = path.partition(":")
+        if not class_name:
+            raise ValueError(f"Sensor module {path} should be given as 'module:Class'")
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def _entry_point(self, sensor_type: str) -> type[Sensor]:
+        for entry_point in entry_points(group=self.ENTRY_POINT_GROUP, name=sensor_type):
+            return entry_point.load()
+        raise ValueError(f"Unknown sensor type {sensor_type}")
+
+# Shared across settings reloads, so each module is imported once
+registry = SensorRegistry()
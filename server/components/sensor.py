@@ -1,16 +1,120 @@
+import asyncio
 import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass, replace
+from typing import Any, AsyncIterator, Optional
 from pydantic import BaseModel
 
+from components.history import SensorHistory
+
 class SensorConfig(BaseModel):
     enabled: bool
     type: str
+    # Samples per second taken in the background, independent of how often clients ask
+    rate: float = 1.0
+    # Number of samples kept per numeric channel for /history, 0 to keep none
+    history: int = 3600
+    # Seconds a read may take before it counts as failed
+    timeout: float = 2.0
+    # Consecutive failed reads before the sensor is left alone and only probed now and then
+    failure_threshold: int = 3
+    # Seconds between probes of a failed sensor, doubling after each failed probe up to max_backoff
+    backoff: float = 1.0
+    max_backoff: float = 60.0
+
+@dataclass(frozen=True)
+class Sample:
+    value: Any
+    timestamp: float
+    # The sensor has stopped responding and this is its last good reading
+    stale: bool = False
+
+class SensorHealthStatus(BaseModel):
+    state: str
+    failures: int
+    timeouts: int
+    last_error: Optional[str]
+    # Epoch seconds
+    last_success: Optional[float]
+    next_probe: Optional[float]
+
+class SensorStatus(SensorConfig):
+    health: SensorHealthStatus
+
+class SensorHealth:
+    '''
+    Circuit breaker for a sensor. After `failure_threshold` failed reads in a row the circuit
+    opens and reads stop, apart from a probe after each backoff period. A successful probe
+    closes it again, a failed one doubles the backoff.
+    '''
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, config: SensorConfig):
+        self.config = config
+        self.state = self.CLOSED
+        # Consecutive failures
+        self.failures = 0
+        self.timeouts = 0
+        self.last_error: Optional[str] = None
+        self.last_success: Optional[float] = None
+        self.backoff = config.backoff
+        self.retry_at = 0.0
+
+    def allow(self) -> bool:
+        '''Whether to read now, moving to half open when a probe is due'''
+        if self.state == self.OPEN and time.monotonic() >= self.retry_at:
+            self.state = self.HALF_OPEN
+        return self.state != self.OPEN
+
+    def succeeded(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = self.config.backoff
+        self.last_success = time.time()
+
+    def failed(self, error: str, timeout: bool = False) -> bool:
+        '''Returns whether this failure opened the circuit'''
+        self.failures += 1
+        self.timeouts += timeout
+        self.last_error = error
+        if self.state == self.HALF_OPEN:
+            self.backoff = min(self.backoff * 2, self.config.max_backoff)
+        elif self.failures < self.config.failure_threshold:
+            return False
+        opened = self.state == self.CLOSED
+        self.state = self.OPEN
+        self.retry_at = time.monotonic() + self.backoff
+        return opened
+
+    def status(self) -> SensorHealthStatus:
+        return SensorHealthStatus(
+            state=self.state,
+            failures=self.failures,
+            timeouts=self.timeouts,
+            last_error=self.last_error,
+            last_success=self.last_success,
+            next_probe=time.time() + max(0.0, self.retry_at - time.monotonic()) if self.state == self.OPEN else None,
+        )
 
 # Base class for sensor
 class Sensor:
+    # Settings for this type of sensor, used to parse its section of settings.toml
+    config_class = SensorConfig
+    # Content type of encode(), for sensors that have a binary form
+    media_type: Optional[str] = None
+
     def __init__(self, config):
         self.logger = logging.getLogger(__name__)
         self.config = config
-        
+        # Most recent reading, replaced as a whole by the scheduler
+        self.latest: Optional[Sample] = None
+        self.history = SensorHistory(config.history) if config.history > 0 else None
+        self.health = SensorHealth(config)
+
     # The main initialization method that is called after the object has been created
     # Should be overriden by the inheriting class. Called only if enabled.
     def configure(self):
@@ -18,3 +122,213 @@ class Sensor:
 
     def read(self):
         pass
+
+    # Compact binary form of a reading, for sensors that have one. Returns the bytes and
+    # whatever should be passed as `previous` with the next reading sent on the same connection.
+    def encode(self, value, previous=None) -> Optional[tuple[bytes, Any]]:
+        return None
+
+    def store(self, sample: Sample) -> Sample:
+        self.latest = sample
+        if self.history is not None:
+            self.history.record(sample.timestamp, sample.value)
+        return sample
+
+class DerivedSensorConfig(SensorConfig):
+    # ID of the sensor this one is computed from
+    source: str
+
+class DerivedSensor(Sensor):
+    '''
+    A sensor computed from another sensor's readings rather than read from hardware. The
+    scheduler calls derive() once for every new reading of the source, on the source's thread,
+    and the result is timestamped with the source's reading. `rate` is ignored.
+    '''
+    config_class = DerivedSensorConfig
+
+    def derive(self, source: Sensor, value) -> Any:
+        pass
+
+    def sample_from(self, source: Sensor, sample: Sample) -> Sample:
+        return self.store(Sample(value=self.derive(source, sample.value), timestamp=sample.timestamp))
+
+class SensorScheduler:
+    '''
+    Samples each enabled sensor at its configured rate on its own worker thread, so reads
+    never happen on the event loop and the number of hardware reads doesn't depend on
+    how many clients are polling.
+    '''
+    def __init__(self, sensors: dict[str, Sensor]):
+        self.logger = logging.getLogger(__name__)
+        self.sensors = sensors
+        self.stopping = threading.Event()
+        self.threads: list[threading.Thread] = []
+        # Told about every new sample, from the sensor's thread
+        self.subscriptions: set[SensorSubscription] = set()
+        self.lock = threading.Lock()
+        # Source sensor ID to the sensors derived from it
+        self.derived: dict[str, list[tuple[str, DerivedSensor]]] = {}
+
+    def start(self):
+        # Attach derived sensors before any source starts producing readings
+        for label, sensor in self.sensors.items():
+            if not sensor.config.enabled or not isinstance(sensor, DerivedSensor):
+                continue
+            source = self.sensors.get(sensor.config.source)
+            if source is None or not source.config.enabled:
+                self.logger.warning(f"Sensor {label} needs sensor {sensor.config.source}, which isn't enabled")
+                continue
+            self.derived.setdefault(sensor.config.source, []).append((label, sensor))
+        for label, sensor in self.sensors.items():
+            if not sensor.config.enabled or isinstance(sensor, DerivedSensor) or sensor.config.rate <= 0:
+                continue
+            thread = threading.Thread(target=self._run, args=(label, sensor), name=f"sensor-{label}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.close()
+
+    def subscribe(self, subscription: 'SensorSubscription'):
+        with self.lock:
+            self.subscriptions.add(subscription)
+
+    def unsubscribe(self, subscription: 'SensorSubscription'):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def _run(self, label: str, sensor: Sensor):
+        period = 1 / sensor.config.rate
+        deadline = time.monotonic()
+        # Reads happen on a worker so a hung device can be given up on. A read that never
+        # returns keeps the worker, and no new read is started until it does.
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sensor-{label}-read")
+        pending: Optional[Future] = None
+        health = sensor.health
+        while not self.stopping.wait(max(0.0, deadline - time.monotonic())):
+            deadline += period
+            # Don't try to catch up on samples missed while a read was slow
+            if deadline < time.monotonic():
+                deadline = time.monotonic()
+            if not health.allow():
+                deadline = max(deadline, health.retry_at)
+                continue
+            if pending is not None and not pending.done():
+                self._failed(label, sensor, "Previous read still hasn't returned", timeout=True)
+                continue
+            pending = executor.submit(sensor.read)
+            try:
+                value = pending.result(timeout=sensor.config.timeout)
+            except TimeoutError:
+                self._failed(label, sensor, f"Read took longer than {sensor.config.timeout}s", timeout=True)
+                continue
+            except Exception as e:
+                self._failed(label, sensor, str(e))
+                continue
+            except SystemExit as e:
+                # Some device libraries call exit() on I/O errors, which would end this thread
+                self._failed(label, sensor, f"Device library exited with status {e.code}")
+                continue
+            if health.state != health.CLOSED:
+                self.logger.info(f"Sensor {label} has recovered")
+            health.succeeded()
+            sample = sensor.store(Sample(value=value, timestamp=time.time()))
+            self._publish(label, sample)
+            for derived_label, derived in self.derived.get(label, []):
+                try:
+                    self._publish(derived_label, derived.sample_from(sensor, sample))
+                except Exception as e:
+                    self.logger.error(f"Computing sensor {derived_label} failed: {e}")
+        executor.shutdown(wait=False)
+
+    def _failed(self, label: str, sensor: Sensor, error: str, timeout: bool = False):
+        self.logger.error(f"Reading sensor {label} failed: {error}")
+        if not sensor.health.failed(error, timeout):
+            return
+        self.logger.warning(f"Sensor {label} stopped responding, retrying in {sensor.health.backoff}s")
+        # Keep serving the last good reading, marked as stale
+        if sensor.latest is not None and not sensor.latest.stale:
+            sensor.latest = replace(sensor.latest, stale=True)
+            self._publish(label, sensor.latest)
+
+    def _publish(self, label: str, sample: Sample):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.notify(label, sample)
+
+class SensorSubscription:
+    '''
+    New samples for a set of sensors, batched for a single client. Each sensor is sent at
+    most at the rate the client asked for, and samples that arrive close together go out
+    in the same batch.
+    '''
+    # Seconds to wait for other sensors' samples before sending a batch
+    BATCH_WINDOW = 0.02
+
+    def __init__(self, scheduler: SensorScheduler):
+        self.scheduler = scheduler
+        self.loop = asyncio.get_running_loop()
+        # Sensor ID to the most updates per second the client wants, 0 for every sample
+        self.rates: dict[str, float] = {}
+        self.pending: dict[str, Sample] = {}
+        self.sent_at: dict[str, float] = {}
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.scheduler.subscribe(self)
+
+    def update(self, rates: dict[str, float]):
+        '''Replace the subscribed sensors, sending their latest samples straight away'''
+        self.rates = {label: float(rate) for label, rate in rates.items() if label in self.scheduler.sensors}
+        self.pending = {label: sample for label, sample in self.pending.items() if label in self.rates}
+        for label in self.rates:
+            if label not in self.sent_at and self.scheduler.sensors[label].latest is not None:
+                self.pending[label] = self.scheduler.sensors[label].latest
+        self.ready.set()
+
+    def notify(self, label: str, sample: Sample):
+        try:
+            self.loop.call_soon_threadsafe(self._add, label, sample)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+    def _add(self, label: str, sample: Sample):
+        if label in self.rates:
+            self.pending[label] = sample
+            self.ready.set()
+
+    def close(self):
+        '''Safe to call from any thread'''
+        self.closed = True
+        self.scheduler.unsubscribe(self)
+        try:
+            self.loop.call_soon_threadsafe(self.ready.set)
+        except RuntimeError:
+            pass
+
+    async def batches(self) -> AsyncIterator[dict[str, Sample]]:
+        while not self.closed:
+            await self.ready.wait()
+            self.ready.clear()
+            await asyncio.sleep(self.BATCH_WINDOW)
+            now = time.monotonic()
+            batch = {}
+            wait = None
+            for label, sample in list(self.pending.items()):
+                rate = self.rates.get(label, 0)
+                remaining = self.sent_at.get(label, 0) + (1 / rate if rate > 0 else 0) - now
+                if remaining <= 0:
+                    batch[label] = self.pending.pop(label)
+                    self.sent_at[label] = now
+                else:
+                    # Too soon for this sensor, hold on to its newest sample until it's due
+                    wait = remaining if wait is None else min(wait, remaining)
+            if wait is not None:
+                self.loop.call_later(wait, self.ready.set)
+            if batch and not self.closed:
+                yield batch
@@ -4,13 +4,15 @@ from typing import TYPE_CHECKING, Optional
 from pydantic import BaseModel
 
 if TYPE_CHECKING:
-    from .camera import CameraParameters
+    from .camera import CameraParameters, CameraBroadcaster
     from .drive import Drive
-    from .sensor import Sensor
+    from .sensor import Sensor, SensorScheduler
     from .arm import Arm
 
 class State(BaseModel):
     cameras: dict[str, 'CameraParameters'] = {}
+    streams: dict[str, 'CameraBroadcaster'] = {}
     sensors: dict[str, 'Sensor'] = {}
+    scheduler: Optional['SensorScheduler'] = None
     drive: Optional['Drive'] = None
     arm: Optional['Arm'] = None
@@ -1,20 +1,21 @@
 import random
 from dataclasses import dataclass
-from components.sensor import Sensor, SensorConfig
+from components.bus import I2CSensorConfig, buses
+from components.sensor import Sensor
 
-class MLX90614SensorConfig(SensorConfig):
+class MLX90614SensorConfig(I2CSensorConfig):
     address: int = 0x5A
     mock: bool = False
 
 class MLX90614Sensor(Sensor):
+    config_class = MLX90614SensorConfig
+
     def configure(self):
         if self.config.mock:
             return
-        # Only import SMBus when trying to use this library
-        # to prevent import errors on non-i2c-enabled systems
         import mlx90614
-        from smbus2 import SMBus
-        i2cbus = SMBus(1)
+        # Shared bus, opened when first used
+        i2cbus = buses.handle(self.config, self.config.address)
         # Create sensor object
         self.sensor = mlx90614.MLX90614(i2cbus, address=self.config.address)
 
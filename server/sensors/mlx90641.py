@@ -1,9 +1,11 @@
-from components.sensor import Sensor, SensorConfig
+from components.bus import I2CSensorConfig, buses
 from .mlx90640 import MLX90640Sensor
 
-class MLX90641SensorConfig(SensorConfig):
+class MLX90641SensorConfig(I2CSensorConfig):
     address: int = 0x33
+    priority: int = 10
     interpolate: bool = False
+    scale: int = 2
     mock: bool = False
 
 '''
@@ -11,6 +13,7 @@ Note: Uses the same 'read()' method as MLX90640
 Only difference is width/height of output and class used from library
 '''
 class MLX90641Sensor(MLX90640Sensor):
+    config_class = MLX90641SensorConfig
     # Set width and height (static)
     width = 16
     height = 12
@@ -22,6 +25,6 @@ class MLX90641Sensor(MLX90640Sensor):
         import seeed_mlx9064x
         # Additional config option for i2c address, default to 0x33
         self.address = self.config.address
+        self.bus = buses.handle(self.config, self.address)
         # Create sensor object
-        self.sensor = seeed_mlx9064x.grove_mxl90641(address=self.address)
-        self.sensor.refresh_rate = seeed_mlx9064x.RefreshRate.REFRESH_4_HZ
+        self.sensor = self.open(seeed_mlx9064x.grove_mxl90641, seeed_mlx9064x.RefreshRate.REFRESH_4_HZ)
@@ -8,6 +8,8 @@ class RandomSensorConfig(SensorConfig):
     maximum: int = 20
 
 class RandomSensor(Sensor):
+    config_class = RandomSensorConfig
+
     def configure(self):
         self.logger.info(f"RandomSensor: Min and max are {self.config.minimum} and {self.config.maximum}")
 
@@ -1,19 +1,21 @@
 from dataclasses import dataclass
 import random
 
-from components.sensor import Sensor, SensorConfig
+from components.bus import I2CSensorConfig, buses
+from components.sensor import Sensor
 
-class SGP30SensorConfig(SensorConfig):
+class SGP30SensorConfig(I2CSensorConfig):
     mock: bool = False
 
 class SGP30Sensor(Sensor):
+    config_class = SGP30SensorConfig
+
     def configure(self):
         if self.config.mock:
             return
         from sgp30 import SGP30
-        from smbus2 import SMBus
-        # I2C bus
-        self.bus = SMBus(1)
+        # Shared I2C bus, the SGP30 is always at 0x58
+        self.bus = buses.handle(self.config, 0x58)
         # Create sensor object
         self.sensor = SGP30(self.bus)
         self.sensor.init_sgp()
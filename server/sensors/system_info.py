@@ -1,44 +1,102 @@
-from dataclasses import dataclass
-import random
 import psutil
 import time
+from typing import Any, Callable
 
 from components.sensor import Sensor, SensorConfig
 
 class SystemInfoConfig(SensorConfig):
-    pass
+    # Seconds between refreshes of each metric, reads in between reuse the last value
+    cpu_interval: float = 1.0
+    memory_interval: float = 2.0
+    process_interval: float = 2.0
+    network_interval: float = 1.0
+    # Walking the hwmon sensors is slow on some ARM boards
+    temperature_interval: float = 10.0
+    disk_interval: float = 60.0
 
 class SystemInfo(Sensor):
+    config_class = SystemInfoConfig
+
+    def configure(self):
+        # Doesn't change while running
+        self.boot_time = psutil.boot_time()
+        # The server itself, to tell its load apart from everything else on the machine
+        self.process = psutil.Process()
+        # Values cached by metric(), with when they were collected
+        self.metrics: dict[str, Any] = {}
+        self.refreshed: dict[str, float] = {}
+        self.network = psutil.net_io_counters()
+        self.network_time = time.monotonic()
+        # The first CPU percentages are meaningless, they only start the measurement
+        psutil.cpu_percent(percpu=True)
+        self.process.cpu_percent()
+
+    def metric(self, name: str, interval: float, collect: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        # Reads only come once a period and jitter around it, so allow half a period early or an
+        # interval equal to the period would only be met every other read
+        slack = 0.5 / self.config.rate if self.config.rate > 0 else 0.0
+        if name not in self.refreshed or now - self.refreshed[name] >= interval - slack:
+            self.metrics[name] = collect()
+            self.refreshed[name] = now
+        return self.metrics[name]
+
     def read(self):
-        temperature: float | None = None
+        cores = self.metric("cpu", self.config.cpu_interval, lambda: psutil.cpu_percent(percpu=True))
+        process = self.metric("process", self.config.process_interval, self.read_process)
+        network = self.metric("network", self.config.network_interval, self.read_network)
+        return {
+            "cpu_percent": round(sum(cores) / len(cores), 1) if cores else None,
+            "cpu_per_core": cores,
+            "memory": self.metric("memory", self.config.memory_interval, lambda: psutil.virtual_memory().percent),
+            "temperature": self.metric("temperature", self.config.temperature_interval, self.read_temperature),
+            "disk_usage": self.metric("disk", self.config.disk_interval, self.read_disk),
+            "uptime_seconds": int(time.time() - self.boot_time),
+            "process_rss": process["rss"],
+            "process_cpu_percent": process["cpu_percent"],
+            "network_sent_rate": network["sent"],
+            "network_received_rate": network["received"],
+        }
+
+    def read_temperature(self) -> float | None:
         # Get highest CPU temp from system
         temp_data = psutil.sensors_temperatures()
         # Check if 'coretemp' is reported by psutil
         if 'coretemp' in temp_data:
             # Find highest CPU core temp
-            highest = 0
-            for core in temp_data['coretemp']:
-                if core.current > highest:
-                    highest = core.current
-            temperature = round(highest, 1)
+            return round(max((core.current for core in temp_data['coretemp']), default=0), 1)
         # Some systems will report temp differently
         # Nvidia Jetson
         elif 'thermal-fan-est' in temp_data:
-            temperature = round(temp_data['thermal-fan-est'][0].current, 1)
+            return round(temp_data['thermal-fan-est'][0].current, 1)
         # Raspberry Pi
         elif 'cpu-thermal' in temp_data:
-            temperature = round(temp_data['cpu-thermal'][0].current, 1)
+            return round(temp_data['cpu-thermal'][0].current, 1)
         elif 'cpu_thermal' in temp_data:
-            temperature = round(temp_data['cpu_thermal'][0].current, 1)
+            return round(temp_data['cpu_thermal'][0].current, 1)
+        return None
 
+    def read_disk(self) -> float:
         disk_usage = psutil.disk_usage('/')
-        disk_percent = round((disk_usage.used / disk_usage.total) * 100, 1)
-        uptime_seconds = int(time.time() - psutil.boot_time())
+        return round((disk_usage.used / disk_usage.total) * 100, 1)
 
-        return {
-            "cpu_percent": psutil.cpu_percent(),
-            "memory": psutil.virtual_memory().percent,
-            "temperature": temperature,
-            "disk_usage": disk_percent,
-            "uptime_seconds": uptime_seconds,
+    def read_process(self) -> dict:
+        with self.process.oneshot():
+            return {
+                # Bytes
+                "rss": self.process.memory_info().rss,
+                # Since the last refresh, can be over 100 when several cores are busy
+                "cpu_percent": self.process.cpu_percent(),
+            }
+
+    def read_network(self) -> dict:
+        '''Bytes per second over all interfaces since the last refresh'''
+        counters = psutil.net_io_counters()
+        now = time.monotonic()
+        elapsed = max(now - self.network_time, 1e-6)
+        rates = {
+            "sent": round((counters.bytes_sent - self.network.bytes_sent) / elapsed),
+            "received": round((counters.bytes_recv - self.network.bytes_recv) / elapsed),
         }
+        self.network, self.network_time = counters, now
+        return rates
@@ -0,0 +1,69 @@
+import numpy as np
+
+from components.sensor import DerivedSensor, DerivedSensorConfig
+
+
+class ThermalAnalyticsSensorConfig(DerivedSensorConfig):
+    # Degrees, pixels at or above this count towards the area and regions
+    threshold: float = 40.0
+    # Also report connected regions above the threshold (needs OpenCV)
+    regions: bool = False
+    # Regions smaller than this many pixels are ignored, and at most max_regions are reported (largest first)
+    min_area: int = 4
+    max_regions: int = 8
+
+
+class ThermalAnalyticsSensor(DerivedSensor):
+    '''
+    Summary statistics of each frame from a thermal camera sensor (mlx90640 or mlx90641), so
+    clients that only need the hotspot or the area above a threshold don't need the frame.
+    Coordinates are in pixels of the source's frames, from the top left.
+    '''
+    config_class = ThermalAnalyticsSensorConfig
+
+    def configure(self):
+        if self.config.regions:
+            # Fail when loading settings rather than on the first frame if OpenCV is missing
+            import cv2
+
+    def derive(self, source, value):
+        width, height = source.output_size
+        frame = np.asarray(value, dtype=np.float64).reshape(height, width)
+        hottest = int(frame.argmax())
+        coldest = int(frame.argmin())
+        mask = frame >= self.config.threshold
+        area = int(np.count_nonzero(mask))
+        result = {
+            "min": float(frame.flat[coldest]),
+            "max": float(frame.flat[hottest]),
+            "mean": float(frame.mean()),
+            "area": area,
+            "area_fraction": area / frame.size,
+            "hotspot": {"x": hottest % width, "y": hottest // width},
+            "coldspot": {"x": coldest % width, "y": coldest // width},
+        }
+        if self.config.regions:
+            result["regions"] = self.regions(frame, mask)
+        return result
+
+    def regions(self, frame: np.ndarray, mask: np.ndarray) -> list[dict]:
+        import cv2
+
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask.view(np.uint8), connectivity=8)
+        # Hottest pixel of each region, label 0 is everything below the threshold
+        peaks = np.full(count, -np.inf)
+        np.maximum.at(peaks, labels.ravel(), frame.ravel())
+        found = [i for i in range(1, count) if stats[i, cv2.CC_STAT_AREA] >= self.config.min_area]
+        found.sort(key=lambda i: stats[i, cv2.CC_STAT_AREA], reverse=True)
+        return [
+            {
+                "x": int(stats[i, cv2.CC_STAT_LEFT]),
+                "y": int(stats[i, cv2.CC_STAT_TOP]),
+                "width": int(stats[i, cv2.CC_STAT_WIDTH]),
+                "height": int(stats[i, cv2.CC_STAT_HEIGHT]),
+                "area": int(stats[i, cv2.CC_STAT_AREA]),
+                "centroid": {"x": float(centroids[i][0]), "y": float(centroids[i][1])},
+                "max": float(peaks[i]),
+            }
+            for i in found[:self.config.max_regions]
+        ]
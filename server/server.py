@@ -1,6 +1,8 @@
+import asyncio
 import json
 import logging
 import shutil
+import struct
 import os
 import glob
 from typing import Optional
@@ -12,78 +14,81 @@ try:
     import tomllib as toml
 except ModuleNotFoundError:
     import tomli as toml
+import anyio
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import HTTPException
 from fastapi.responses import PlainTextResponse
-
-from components.camera import CameraComponent, CameraParameters
-from components.drive import DummyConnection, SimpleSerialConnection
-from components.sensor import SensorConfig, Sensor
+from starlette.routing import Mount, Route, Router
+
+from components.bus import buses
+from components.camera import CameraBroadcaster, CameraComponent, CameraDevice, CameraParameters
+from components.registry import registry
+from components.recorder import CameraRecorder, RecorderConfig
+from components.drive import PROTOCOLS, DummyConnection, SimpleSerialConnection
+from components.sensor import SensorConfig, Sensor, SensorScheduler, SensorStatus, SensorSubscription
 from components.state import State
 from components.arm import Arm, ArmConfig
-from sensors.mlx90614 import MLX90614Sensor, MLX90614SensorConfig
-from sensors.random_sensor import RandomSensor, RandomSensorConfig
-from sensors.system_info import SystemInfo, SystemInfoConfig
-from sensors.sgp30 import SGP30SensorConfig, SGP30Sensor
-from sensors.mlx90640 import MLX90640Sensor, MLX90640SensorConfig
-from sensors.mlx90641 import MLX90641Sensor, MLX90641SensorConfig
 from util.helpers import SinglePageApplication
 
 logging.basicConfig(format='%(levelname)s: %(name)s: %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-sensorRegister = {
-    "mlx90614": (MLX90614Sensor, MLX90614SensorConfig),
-    "mlx90640": (MLX90640Sensor, MLX90640SensorConfig),
-    "mlx90641": (MLX90641Sensor, MLX90641SensorConfig),
-    "random": (RandomSensor, RandomSensorConfig),
-    "sgp30": (SGP30Sensor, SGP30SensorConfig),
-    "system_info": (SystemInfo, SystemInfoConfig)
-}
-
-
 def load_state() -> State:
     new_state: State = State()
     with open("settings.toml", mode="rb") as fp:
         config = toml.load(fp)
 
     if config["drive"]["enabled"]:
+        # Any other keys under [drive.protocol] are passed to the protocol, e.g. address
+        protocol = dict(config["drive"].get("protocol", {}))
         new_state.drive = SimpleSerialConnection(
             port=config["drive"]["connection"]["port"],
             baudrate=config["drive"]["connection"]["baudrate"],
-            channels=config["drive"]["channels"]
+            channels=config["drive"]["channels"],
+            protocol=PROTOCOLS[protocol.pop("type", "simplified")](**protocol)
         )
     else:
         new_state.drive = DummyConnection()
 
     new_state.arm = Arm(ArmConfig(**config["arm"]))
 
-    for label, index in config["camera"]["devices"].items():
-        camera_config = CameraParameters(
-            id=label,
-            width=config["camera"]["width"],
-            height=config["camera"]["height"],
-            framerate=config["camera"]["framerate"],
-            quality=config["camera"]["quality"],
-            source=index)
+    for label, device in config["camera"]["devices"].items():
+        # A device is either just its source, or a table overriding the [camera] settings
+        if not isinstance(device, dict):
+            device = {"source": device}
+        camera_config = CameraParameters(**{**config["camera"], **device, "id": label})
         new_state.cameras[label] = camera_config
+        recorder = None
+        if camera_config.record:
+            recorder_config = RecorderConfig(**config.get("recorder", {}))
+            try:
+                camera_config.profile(recorder_config.variant)
+            except KeyError as e:
+                # A recorder typo shouldn't take the live stream down with it
+                logger.error(f"Not recording camera {label}: {e}")
+            else:
+                recorder = CameraRecorder(label, recorder_config)
+        new_state.streams[label] = CameraBroadcaster(camera_config, recorder)
 
     for label in config["sensors"]:
         # Load sensor configuration as a dict
         conf: dict = config["sensors"][label]
-        # Find the respective Sensor and SensorConfig class from the register
-        sensor_class, sensor_config_class = sensorRegister[conf["type"]]
+        # Only import the modules of sensors that are enabled, disabled ones are just listed
+        sensor_class = registry.load(conf["type"], conf.get("module")) if conf.get("enabled") else Sensor
         # Create the SensorConfig object containing the configuration settings for the sensor
-        conf_obj: SensorConfig = sensor_config_class(**conf)
+        conf_obj: SensorConfig = sensor_class.config_class(**conf)
         new_state.sensors[label] = sensor_class(conf_obj)
         # Run initial configuration for the sensor
         if conf_obj.enabled:
             new_state.sensors[label].configure()
         logger.info(f"Created sensor of type {conf['type']}")
 
+    new_state.scheduler = SensorScheduler(new_state.sensors)
+    new_state.scheduler.start()
+
     return new_state
 
 
@@ -97,7 +102,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 api = FastAPI()
-app.mount("/api/camera/{id:str}", CameraComponent.stream)
+app.mount("/api/camera/{id:str}", Router(routes=[
+    Route("/stats", CameraComponent.stats),
+    Route("/snapshot", CameraComponent.snapshot),
+    Route("/recording", CameraComponent.recording),
+    Route("/recording/export", CameraComponent.export),
+    Mount("", CameraComponent.stream),
+]))
 app.mount("/api", api, name="api")
 app.mount("/docs/", SinglePageApplication(directory="../docs/.vitepress/dist"), name="docs")
 app.mount("/", SinglePageApplication(directory="../client/dist"), name="frontend")
@@ -112,8 +123,12 @@ async def list_cameras() -> list[str]:
     return list(app.state.cameras.keys())
 
 @api.get("/camera/all")
-def list_available_cameras() -> list[int]:
-    return CameraComponent.list_available()
+def list_available_cameras(rescan: bool = False) -> list[int]:
+    return [device.index for device in CameraComponent.list_available(rescan)]
+
+@api.get("/camera/devices")
+def list_camera_devices(rescan: bool = False) -> list[CameraDevice]:
+    return CameraComponent.list_available(rescan)
 
 class MoveMotorsParams(BaseModel):
     speed: list[int]
@@ -126,16 +141,207 @@ async def drive(params: MoveMotorsParams):
 async def drive_stop():
     app.state.drive.stop()
 
+@api.websocket("/control")
+async def control(websocket: WebSocket):
+    '''
+    Teleoperation over a single connection. The client sends commands with an increasing "seq":
+        {"seq": 1, "type": "drive", "speed": [left, right]}
+        {"seq": 2, "type": "stop"}
+        {"seq": 3, "type": "servo", "servo": "ELBOW", "direction": true}  jogs the joint while repeated, with
+            an optional "speed" in degrees per second, or moves it by "amount" degrees if that is given
+        {"seq": 4, "type": "home"}, {"seq": 5, "type": "preset", "preset": "drive"}
+        {"seq": 6, "type": "arm_stop"}  halts the arm, or with "servo" only ends that joint's jog
+    and each is acknowledged with {"ack": seq, "t": <server time in ms>}, plus "dropped": true if it was
+    older than a command already applied or "error" if it couldn't be applied (with "ack": null if the
+    message itself couldn't be read). Stops are never dropped,
+    and the drive is stopped if the connection closes while it was moving.
+    '''
+    await websocket.accept()
+    last = None
+    driving = False
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            received = time() * 1000
+            reply = {"ack": None, "t": received}
+            # A malformed frame is answered with an error like any other bad command, rather than closing the socket
+            try:
+                message = json.loads(frame.get("text") or frame.get("bytes") or "")
+                if not isinstance(message, dict):
+                    raise TypeError(f"Expected a JSON object, got {type(message).__name__}")
+                seq = message.get("seq")
+                if seq is not None and (isinstance(seq, bool) or not isinstance(seq, int)):
+                    raise TypeError(f"seq should be an integer, got {seq!r}")
+                reply["ack"] = seq
+                kind = message.get("type")
+                if kind != "stop" and seq is not None and last is not None and seq <= last:
+                    reply["dropped"] = True
+                    await websocket.send_json(reply)
+                    continue
+                if seq is not None:
+                    last = seq if last is None else max(last, seq)
+                if kind == "drive":
+                    speed = [int(value) for value in message["speed"]]
+                    if len(speed) != 2:
+                        raise ValueError(f"speed should be [left, right], got {len(speed)} values")
+                    app.state.drive.move(speed)
+                    driving = any(speed)
+                elif kind == "stop":
+                    app.state.drive.stop()
+                    driving = False
+                elif kind == "servo":
+                    if message.get("amount") is not None:
+                        app.state.arm.increment_angle(message["servo"], bool(message["direction"]), float(message["amount"]))
+                    else:
+                        speed = message.get("speed")
+                        app.state.arm.jog(message["servo"], bool(message["direction"]), None if speed is None else float(speed))
+                elif kind == "home":
+                    await app.state.arm.home()
+                elif kind == "preset":
+                    await app.state.arm.move_preset(message["preset"])
+                elif kind == "arm_stop":
+                    app.state.arm.halt(message.get("servo"))
+                else:
+                    raise ValueError(f"Unknown command type {kind}")
+            except (KeyError, TypeError, ValueError) as e:
+                reply["error"] = f"{type(e).__name__}: {e}"
+            await websocket.send_json(reply)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if driving:
+            app.state.drive.stop()
+
 @api.get("/sensor/list/")
-async def sensor_list() -> dict[str, SensorConfig]:
-    return {k: s.config for (k, s) in app.state.sensors.items()}
+async def sensor_list() -> dict[str, SensorStatus]:
+    return {k: SensorStatus(**s.config.dict(), health=s.health.status()) for (k, s) in app.state.sensors.items()}
+
+@api.get("/bus/")
+async def bus_stats():
+    '''Time spent on and waiting for each I2C bus, and errors, per device'''
+    return buses.stats()
+
+@api.websocket("/sensor/subscribe")
+async def sensor_subscribe(websocket: WebSocket):
+    '''
+    Push sensor samples as they are taken. The client sends {"sensors": {"<id>": <max updates per second>}}
+    (0 for every sample), and can send it again at any time to change the set. Each message from the
+    server is {"timestamp": ..., "data": {"<id>": {"value": ..., "timestamp": ..., "stale": ...}}}, covering every
+    sensor with a new sample since the last message. A message that can't be read is answered with
+    {"error": ...} and leaves the subscription unchanged.
+
+    If the client also sends "format": "binary", sensors with a binary encoding (thermal cameras) are sent
+    as separate binary messages instead: the ID's length as a byte, the ID, the sample's timestamp as a
+    little-endian double, then the encoded reading. Thermal frames after the first are sent as deltas
+    from the previous one when they fit.
+    '''
+    await websocket.accept()
+    subscription = SensorSubscription(app.state.scheduler)
+    binary = False
+    # Last reading sent of each binary sensor, for delta encoding
+    previous = {}
+
+    async def receive():
+        nonlocal binary
+        try:
+            while True:
+                frame = await websocket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(frame.get("code", 1000))
+                # A malformed message is answered with an error and leaves the subscription as it was
+                try:
+                    message = json.loads(frame.get("text") or frame.get("bytes") or "")
+                    if not isinstance(message, dict):
+                        raise TypeError(f"Expected a JSON object, got {type(message).__name__}")
+                    sensors = message.get("sensors", {})
+                    if not isinstance(sensors, dict):
+                        raise TypeError(f"sensors should be an object, got {type(sensors).__name__}")
+                    rates = {label: float(rate) for label, rate in sensors.items()}
+                except (TypeError, ValueError) as e:
+                    await websocket.send_json({"error": f"{type(e).__name__}: {e}"})
+                    continue
+                binary = message.get("format", "json") == "binary"
+                if not binary:
+                    previous.clear()
+                subscription.update(rates)
+        except WebSocketDisconnect:
+            pass
+
+    async def push():
+        async for batch in subscription.batches():
+            data = {}
+            for label, sample in batch.items():
+                encoded = app.state.sensors[label].encode(sample.value, previous.get(label)) if binary else None
+                if encoded is None:
+                    data[label] = {
+                        "value": jsonable_encoder(sample.value),
+                        "timestamp": sample.timestamp * 1000,
+                        "stale": sample.stale,
+                    }
+                    continue
+                frame, previous[label] = encoded
+                name = label.encode()
+                await websocket.send_bytes(bytes([len(name)]) + name + struct.pack("<d", sample.timestamp * 1000) + frame)
+            if data:
+                await websocket.send_json({"timestamp": time() * 1000, "data": data})
+        # Settings were reloaded, the client should reconnect
+        await websocket.close(code=1012)
+
+    tasks = [asyncio.create_task(receive()), asyncio.create_task(push())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        subscription.close()
+
+@api.get("/sensor/{sensor_id}/history")
+def sensor_history(sensor_id: str, start: Optional[float] = Query(None, alias="from"),
+                   end: Optional[float] = Query(None, alias="to"), points: int = Query(300, ge=1, le=2000)):
+    '''
+    Readings between from and to (milliseconds since the epoch, defaulting to the last hour),
+    downsampled to at most `points` buckets per channel with the min, max and mean of each.
+    '''
+    if sensor_id not in app.state.sensors.keys():
+        raise HTTPException(404, f"Sensor with ID of {sensor_id} not found")
+    history = app.state.sensors[sensor_id].history
+    if history is None:
+        raise HTTPException(404, f"Sensor with ID of {sensor_id} doesn't keep history")
+    end = time() if end is None else end / 1000
+    start = end - 3600 if start is None else start / 1000
+    if start >= end:
+        raise HTTPException(400, "Invalid range")
+    channels = history.query(start, end, points)
+    for buckets in channels.values():
+        buckets["t"] = [t * 1000 for t in buckets["t"]]
+    return channels
 
 @api.get("/sensor/{sensor_id}")
-async def sensor(sensor_id: str):
+async def sensor(sensor_id: str, request: Request, response: Response, format: str = "json"):
+    '''
+    Latest reading of a sensor. Thermal cameras can also be read as a binary frame (see util/thermal.py)
+    with ?format=binary or by accepting application/x-thermal-frame.
+    '''
     if sensor_id not in app.state.sensors.keys():
         raise HTTPException(404, f"Sensor with ID of {sensor_id} not found")
-    #print("New request for " + sensor_id)
-    return app.state.sensors[sensor_id].read()
+    # Sensors are sampled in the background, this never touches the hardware
+    sample = app.state.sensors[sensor_id].latest
+    if sample is None:
+        raise HTTPException(503, f"Sensor with ID of {sensor_id} has no reading yet")
+    headers = {"X-Sample-Timestamp": f"{sample.timestamp:.3f}"}
+    if sample.stale:
+        # The sensor isn't responding, see /sensor/list/ for its health
+        headers["X-Sample-Stale"] = "true"
+    media_type = app.state.sensors[sensor_id].media_type
+    if format == "binary" or (media_type and media_type in request.headers.get("accept", "")):
+        encoded = app.state.sensors[sensor_id].encode(sample.value)
+        if encoded is None:
+            raise HTTPException(406, f"Sensor with ID of {sensor_id} has no binary format")
+        return Response(encoded[0], media_type=media_type, headers=headers)
+    response.headers.update(headers)
+    return sample.value
 
 class MoveArmServoParams(BaseModel):
     direction: bool
@@ -143,7 +349,16 @@ class MoveArmServoParams(BaseModel):
 
 @api.post("/arm/servo/{servo_name}")
 async def arm_move(servo_name: str, params: MoveArmServoParams):
-    app.state.arm.increment_angle(servo_name, params.direction, params.amount)
+    # Without an amount the joint keeps moving at a steady speed for as long as requests keep coming
+    if params.amount is None:
+        app.state.arm.jog(servo_name, params.direction)
+    else:
+        app.state.arm.increment_angle(servo_name, params.direction, params.amount)
+
+@api.post("/arm/stop")
+async def arm_stop(servo: Optional[str] = None):
+    # With a servo only its jog ends, for releasing one of several held keys
+    app.state.arm.halt(servo)
 
 @api.post("/arm/home")
 async def arm_home():
@@ -163,10 +378,21 @@ async def reboot():
     print("Rebooting...")
     #os.system('reboot')
 
+@app.on_event("startup")
+async def start_recording():
+    for stream in app.state.streams.values():
+        stream.start_recording()
+
 @api.post("/reload")
 def reload():
     app.state.drive.close()
+    app.state.arm.close()
+    app.state.scheduler.stop()
+    for stream in app.state.streams.values():
+        stream.close()
     app.state = load_state()
+    # Recordings run on the event loop, this endpoint runs in a worker thread
+    anyio.from_thread.run(start_recording)
 
 @api.get("/settings")
 async def get_settings() -> str:
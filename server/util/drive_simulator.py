@@ -0,0 +1,130 @@
+'''
+Loopback motor controller on a pseudo-terminal, for measuring the drive output path without hardware.
+
+The drive writes to the pty like it would to a real serial port, and the simulator decodes whatever
+arrives with the same protocol. A pty has no line speed, so arrival times are modelled as a UART at
+the given baud rate (10 bits per byte) to include the time commands spend on the wire.
+
+Run from the server directory:
+    python -m util.drive_simulator --protocol simplified --commands 500 --rate 50
+'''
+import argparse
+import bisect
+import math
+import os
+import select
+import statistics
+import threading
+import time
+import tty
+from typing import Optional
+
+from components.drive import PROTOCOLS, DriveProtocol, SimpleSerialConnection
+
+class DriveSimulator:
+    def __init__(self, protocol: DriveProtocol, baudrate: int = 9600):
+        self.protocol = protocol
+        self.byte_time = 10 / baudrate
+        self.master, self.slave = os.openpty()
+        # No line discipline, bytes should arrive exactly as written
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        # (time read, modelled arrival time, motor or None for stop, speed) for every decoded command
+        self.received: list[tuple[float, float, Optional[int], int]] = []
+        self.bytes = 0
+        self.line_free = 0.0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._read, name="drive-simulator", daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        buffer = b""
+        while not self.stopping.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not ready:
+                continue
+            data = os.read(self.master, 4096)
+            now = time.perf_counter()
+            self.bytes += len(data)
+            # Bytes leave the UART one after another, starting when the line is free
+            self.line_free = max(self.line_free, now) + len(data) * self.byte_time
+            commands, consumed = self.protocol.decode(buffer + data)
+            buffer = (buffer + data)[consumed:]
+            for motor, speed in commands:
+                self.received.append((now, self.line_free, motor, speed))
+
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+def benchmark(protocol_name: str, commands: int, rate: float, baudrate: int) -> dict:
+    '''
+    Sends a sweep of drive commands at `rate` per second (0 for as fast as possible) and reports
+    how many reached the wire and how long after they were issued.
+    '''
+    protocol = PROTOCOLS[protocol_name]()
+    simulator = DriveSimulator(protocol, baudrate)
+    drive = SimpleSerialConnection(simulator.path, baudrate, {"left": 0, "right": 1}, protocol)
+    # (motor, speed as decoded) to the times it was issued
+    issued: dict[tuple[int, int], list[float]] = {}
+    started = time.perf_counter()
+    for i in range(commands):
+        speed = round(1000 * math.sin(i / 20))
+        now = time.perf_counter()
+        for motor, motor_speed in enumerate((speed, -speed)):
+            decoded, _ = protocol.decode(protocol.encode(motor, motor_speed))
+            issued.setdefault(decoded[0], []).append(now)
+        drive.move([speed, -speed])
+        if rate > 0:
+            time.sleep(max(0.0, started + (i + 1) / rate - time.perf_counter()))
+    # Let the sweep drain before stopping, stop() discards whatever hasn't been written yet
+    drained = -1
+    while simulator.bytes != drained:
+        drained = simulator.bytes
+        time.sleep(0.2)
+    drive.stop()
+    time.sleep(0.2)
+    elapsed = time.perf_counter() - started
+    drive.close()
+    simulator.close()
+
+    # The stop is written last. Some protocols stop by setting every motor to 0, which looks like
+    # an issued command, so only its own encoding is left out, and commands that were still
+    # draining after the sweep are counted
+    received = simulator.received
+    stop, _ = protocol.decode(protocol.stop())
+    if [(motor, speed) for _, _, motor, speed in received[-len(stop):]] == stop:
+        received = received[:-len(stop)]
+    latencies = []
+    for read, arrived, motor, speed in received:
+        times = issued.get((motor, speed), [])
+        # Matched with the newest time it was issued before it was written
+        index = bisect.bisect_right(times, read) - 1
+        if index >= 0:
+            latencies.append((arrived - times[index]) * 1000)
+    latencies.sort()
+    return {
+        "protocol": protocol_name,
+        "issued": commands * 2,
+        "written": len(latencies),
+        # Replaced by a newer command before they were written, or unchanged
+        "coalesced": commands * 2 - len(latencies),
+        "bytes": simulator.bytes,
+        "bytes_per_second": round(simulator.bytes / elapsed),
+        "latency_ms": {
+            "median": round(statistics.median(latencies), 2) if latencies else None,
+            "p95": round(latencies[max(0, math.ceil(len(latencies) * 0.95) - 1)], 2) if latencies else None,
+            "max": round(latencies[-1], 2) if latencies else None,
+        },
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure command-to-wire latency of the drive output")
+    parser.add_argument("--protocol", choices=sorted(PROTOCOLS), default="simplified")
+    parser.add_argument("--commands", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=50.0, help="commands per second, 0 for as fast as possible")
+    parser.add_argument("--baudrate", type=int, default=9600)
+    args = parser.parse_args()
+    print(benchmark(args.protocol, args.commands, args.rate, args.baudrate))
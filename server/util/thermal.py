@@ -0,0 +1,96 @@
+'''
+Compact binary encoding for thermal camera frames.
+
+A frame is a header followed by the pixels in row-major order:
+
+    magic    4s   b"THRM"
+    version  B    1
+    flags    B    FLAG_DELTA if the pixels are differences from the previous frame
+    width    H
+    height   H
+    min      h    coldest pixel, centi-degrees
+    max      h    hottest pixel, centi-degrees
+
+All fields are little-endian. Full frames carry int16 centi-degrees per pixel. Delta
+frames carry int8 centi-degree differences from the previous frame sent on the same
+connection, and are only used when every difference fits.
+'''
+import struct
+from typing import Optional
+
+import numpy as np
+
+HEADER = struct.Struct("<4sBBHHhh")
+MAGIC = b"THRM"
+VERSION = 1
+FLAG_DELTA = 0x01
+MEDIA_TYPE = "application/x-thermal-frame"
+
+
+def quantize(frame, width: int, height: int) -> np.ndarray:
+    '''Frame in degrees to int16 centi-degrees, clipped to what int16 can hold'''
+    values = np.rint(np.asarray(frame, dtype=np.float32).reshape(height * width) * 100)
+    return np.clip(values, -32768, 32767).astype("<i2")
+
+
+def encode(frame, width: int, height: int, previous: Optional[np.ndarray] = None) -> tuple[bytes, np.ndarray]:
+    '''
+    Returns the encoded frame and its quantized pixels, which should be passed back as
+    `previous` for the next frame on the same connection to get delta frames.
+    '''
+    current = quantize(frame, width, height)
+    flags = 0
+    pixels = current
+    if previous is not None and previous.shape == current.shape:
+        delta = current.astype(np.int32) - previous
+        if delta.min() >= -128 and delta.max() <= 127:
+            flags |= FLAG_DELTA
+            pixels = delta.astype(np.int8)
+    header = HEADER.pack(MAGIC, VERSION, flags, width, height, int(current.min()), int(current.max()))
+    return header + pixels.tobytes(), current
+
+
+def interpolation_kernel(size: int, scale: int) -> np.ndarray:
+    '''
+    Matrix that linearly upscales a vector of `size` samples by `scale` when multiplied with
+    it, sampling at pixel centres and clamping at the edges.
+    '''
+    positions = np.clip((np.arange(size * scale) + 0.5) / scale - 0.5, 0, size - 1)
+    low = np.floor(positions).astype(int)
+    high = np.minimum(low + 1, size - 1)
+    weight = positions - low
+    kernel = np.zeros((size * scale, size))
+    rows = np.arange(size * scale)
+    kernel[rows, low] += 1 - weight
+    kernel[rows, high] += weight
+    return kernel
+
+
+class ThermalFrames:
+    '''
+    Processing for frames from a thermal camera, with every buffer allocated once.
+
+    Readings go into `raw` (or the flat `buffer` view of it), and process() mirrors and
+    upscales them into `output`, which is overwritten by the next call.
+    '''
+    def __init__(self, width: int, height: int, scale: int = 1):
+        self.width = width
+        self.height = height
+        self.scale = max(1, scale)
+        self.raw = np.zeros((height, width))
+        self.buffer = self.raw.reshape(-1)
+        self.output = np.empty((height * self.scale, width * self.scale))
+        if self.scale > 1:
+            # Upscaling is rows @ frame @ columns, with both kernels computed up front
+            self.rows = interpolation_kernel(height, self.scale)
+            self.columns = interpolation_kernel(width, self.scale).T.copy()
+            self.partial = np.empty((height * self.scale, width))
+
+    def process(self, mirror: bool = False) -> np.ndarray:
+        frame = self.raw[:, ::-1] if mirror else self.raw
+        if self.scale == 1:
+            np.copyto(self.output, frame)
+        else:
+            np.matmul(self.rows, frame, out=self.partial)
+            np.matmul(self.partial, self.columns, out=self.output)
+        return self.output
@@ -0,0 +1,110 @@
+'''
+Minimal V4L2 device enumeration using sysfs and a few query ioctls.
+Nothing here starts a stream, so it is safe to call while a device is in use.
+'''
+import fcntl
+import glob
+import os
+import re
+import struct
+
+# ioctl request numbers, see linux/videodev2.h
+VIDIOC_QUERYCAP = 0x80685600
+VIDIOC_ENUM_FMT = 0xC0405602
+VIDIOC_ENUM_FRAMESIZES = 0xC02C564A
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+V4L2_FRMSIZE_TYPE_DISCRETE = 1
+
+# struct v4l2_capability
+CAPABILITY = struct.Struct("16s32s32sIII12x")
+# struct v4l2_fmtdesc
+FMTDESC = struct.Struct("III32sII12x")
+# struct v4l2_frmsizeenum, discrete and stepwise sizes share the union
+FRMSIZEENUM = struct.Struct("IIIIIIIII8x")
+
+
+def device_paths() -> list[str]:
+    return sorted(glob.glob("/dev/video*"), key=device_index)
+
+
+def device_index(path: str) -> int:
+    match = re.search(r"(\d+)$", path)
+    return int(match.group(1)) if match else -1
+
+
+def sysfs_attribute(path: str, attribute: str) -> str | None:
+    try:
+        with open(f"/sys/class/video4linux/{os.path.basename(path)}/{attribute}") as fp:
+            return fp.read().strip()
+    except OSError:
+        return None
+
+
+def fourcc_to_str(fourcc: int) -> str:
+    return fourcc.to_bytes(4, "little").decode("ascii", errors="replace").strip()
+
+
+def query(path: str) -> dict | None:
+    '''Returns the name and supported capture formats of a device, or None if it can't capture video'''
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        buffer = bytearray(CAPABILITY.size)
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, buffer)
+        driver, card, bus_info, _, capabilities, device_caps = CAPABILITY.unpack(buffer)
+        # Devices such as UVC metadata nodes share the driver but don't capture video
+        if capabilities & V4L2_CAP_DEVICE_CAPS:
+            capabilities = device_caps
+        if not capabilities & V4L2_CAP_VIDEO_CAPTURE:
+            return None
+        return {
+            "name": sysfs_attribute(path, "name") or card.rstrip(b"\0").decode(errors="replace"),
+            "driver": driver.rstrip(b"\0").decode(errors="replace"),
+            "bus": bus_info.rstrip(b"\0").decode(errors="replace"),
+            "formats": formats(fd),
+        }
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def formats(fd: int) -> dict[str, list[str]]:
+    result = {}
+    index = 0
+    while True:
+        buffer = bytearray(FMTDESC.pack(index, V4L2_BUF_TYPE_VIDEO_CAPTURE, 0, b"", 0, 0))
+        try:
+            fcntl.ioctl(fd, VIDIOC_ENUM_FMT, buffer)
+        except OSError:
+            break
+        pixelformat = FMTDESC.unpack(buffer)[4]
+        result[fourcc_to_str(pixelformat)] = frame_sizes(fd, pixelformat)
+        index += 1
+    return result
+
+
+def frame_sizes(fd: int, pixelformat: int) -> list[str]:
+    sizes = []
+    index = 0
+    while True:
+        buffer = bytearray(FRMSIZEENUM.pack(index, pixelformat, 0, 0, 0, 0, 0, 0, 0))
+        try:
+            fcntl.ioctl(fd, VIDIOC_ENUM_FRAMESIZES, buffer)
+        except OSError:
+            break
+        _, _, size_type, *values = FRMSIZEENUM.unpack(buffer)
+        if size_type == V4L2_FRMSIZE_TYPE_DISCRETE:
+            sizes.append(f"{values[0]}x{values[1]}")
+        else:
+            # Stepwise or continuous, only the bounds are reported
+            min_width, max_width, _, min_height, max_height, _ = values
+            sizes.append(f"{min_width}x{min_height}-{max_width}x{max_height}")
+            break
+        index += 1
+    return sizes